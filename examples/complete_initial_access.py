@@ -166,6 +166,7 @@ class stop_and_wait_ia(gr.top_block, Qt.QWidget):
         self._qtgui_waterfall_sink_x_0_win = sip.wrapinstance(self.qtgui_waterfall_sink_x_0.pyqwidget(), Qt.QWidget)
         self.top_layout.addWidget(self._qtgui_waterfall_sink_x_0_win)
         self.stamina_rss_calc_0_0 = stamina.rss_calc(1000, 4000)
+        self.stamina_beam_tagger_0 = stamina.beam_tagger(samp_rate, False)
         self.stamina_rate_measure_0 = stamina.rate_measure("/home/user/rate_meas_" + file_suffix + ".log", 1e-3, False)
         self.stamina_kpi_agg_0 = stamina.kpi_agg("/home/user/kpi_beam_" + file_suffix + ".log", "/home/user/kpi_meas_" + file_suffix + ".log", False, meas_period, -90.0, True)
         self.stamina_beam_sweep_0 = stamina.beam_sweep(False, tx_beams, rx_beams, beam_period, ia_interval, True)
@@ -215,6 +216,9 @@ class stop_and_wait_ia(gr.top_block, Qt.QWidget):
         self.msg_connect((self.stamina_beam_mapper_0, 'gpio_cmd'), (self.uhd_usrp_sink_0_0, 'command'))
         self.msg_connect((self.stamina_beam_selector_0, 'sweep'), (self.stamina_beam_sweep_0, 'sweep'))
         self.msg_connect((self.stamina_beam_sweep_0, 'beam_id'), (self.stamina_beam_mapper_0, 'beam_id'))
+        self.msg_connect((self.stamina_beam_sweep_0, 'beam_id'), (self.stamina_beam_tagger_0, 'beam_id'))
+        self.msg_connect((self.stamina_beam_tagger_0, 'usrp_time'), (self.stamina_beam_mapper_0, 'usrp_time'))
+        self.msg_connect((self.stamina_beam_sweep_0, 'probe'), (self.stamina_beam_selector_0, 'probe'))
         self.msg_connect((self.stamina_beam_sweep_0, 'trigger'), (self.stamina_beam_selector_0, 'trigger'))
         self.msg_connect((self.stamina_beam_sweep_0, 'trigger'), (self.stamina_kpi_agg_0, 'trigger'))
         self.msg_connect((self.stamina_beam_sweep_0, 'beam_id'), (self.stamina_kpi_agg_0, 'beam_id'))
@@ -225,9 +229,10 @@ class stop_and_wait_ia(gr.top_block, Qt.QWidget):
         self.connect((self.blocks_stream_to_tagged_stream_0, 0), (self.digital_ofdm_tx_0, 0))
         self.connect((self.digital_ofdm_rx_0, 0), (self.stamina_rate_measure_0, 0))
         self.connect((self.digital_ofdm_tx_0, 0), (self.blocks_multiply_const_vxx_0_0, 0))
+        self.connect((self.stamina_beam_tagger_0, 0), (self.stamina_rss_calc_0_0, 0))
         self.connect((self.stamina_rss_calc_0_0, 0), (self.stamina_kpi_agg_0, 0))
         self.connect((self.uhd_usrp_source_0, 0), (self.digital_ofdm_rx_0, 0))
-        self.connect((self.uhd_usrp_source_0, 0), (self.stamina_rss_calc_0_0, 0))
+        self.connect((self.uhd_usrp_source_0, 0), (self.stamina_beam_tagger_0, 0))
         self.connect((self.uhd_usrp_source_0, 0), (self.qtgui_waterfall_sink_x_0, 0))
 
 
@@ -288,6 +293,7 @@ class stop_and_wait_ia(gr.top_block, Qt.QWidget):
     def set_samp_rate(self, samp_rate):
         self.samp_rate = samp_rate
         self.qtgui_waterfall_sink_x_0.set_frequency_range(self.center_freq, self.samp_rate*2)
+        self.stamina_beam_tagger_0.set_samp_rate(self.samp_rate)
         self.uhd_usrp_sink_0_0.set_samp_rate(self.samp_rate)
         self.uhd_usrp_sink_0_0.set_bandwidth(0.5*self.samp_rate, 0)
         self.uhd_usrp_source_0.set_samp_rate(self.samp_rate)
@@ -41,7 +41,9 @@ except module_not_found_error:
 # import any pure python here
 from .beam_mapper import beam_mapper
 from .beam_sweep import beam_sweep
+from .beam_tagger import beam_tagger
 from .rss_calc import rss_calc
+from .rss_engine import rss_engine
 from .kpi_agg import kpi_agg
 
 from .beam_selector import beam_selector
@@ -23,14 +23,17 @@ import logging
 from gnuradio import gr
 import pmt
 import numpy as np
+from json import load
 from time import sleep
+from .timebase import clock, usrp_clock
 
 class beam_mapper(gr.basic_block):
     """
     docstring for block beam_mapper
     """
     def __init__(self, tx_mhu="MHU1", rx_mhu="MHU2", backoff=1e-6, pulse=1e-6,
-                 config_path="/home/user/gpio_map.json", debug=False):
+                 config_path="/home/user/gpio_map.json", debug=False,
+                 coalesce=False, timed=False, lead_time=1e-3):
 
         # List of valid names
         valid_names = ["mhu1", "MHU1", "mhu2", "MHU2", "Disabled", "Off"]
@@ -40,6 +43,10 @@ class beam_mapper(gr.basic_block):
                 or (tx_mhu == rx_mhu and tx_mhu not in ["Disabled", "Off"]):
             raise ValueError('Invalid TX ' + str(tx_mhu) + " RX " + str(rx_mhu))
 
+        # Without sleeps, only the USRP can space the BA write and the strobe
+        if coalesce and not timed:
+            raise ValueError('Coalesced GPIO commands need timed commands')
+
        # Let's try to open the GPIO configuration file
         try:
             with open(config_path, 'r') as config_file:
@@ -82,14 +89,43 @@ class beam_mapper(gr.basic_block):
 
         # Register message ports
         self.message_port_register_in(pmt.intern('beam_id'))
+        self.message_port_register_in(pmt.intern('usrp_time'))
         self.message_port_register_out(pmt.intern('gpio_cmd'))
 
-        # Assign beam ID message handler
+        # Assign beam ID and USRP time message handlers
         self.set_msg_handler(pmt.intern('beam_id'), self.beam_id_msg_handler)
+        self.set_msg_handler(pmt.intern('usrp_time'), self.usrp_time_msg_handler)
 
         # Set class variables
         self._backoff = backoff
         self._pulse = pulse
+        self._gpio_port = pmt.intern('gpio_cmd')
+
+        # Release the strobe with the BA write of the next beam change, so
+        # each change takes two commands, timed by the USRP
+        self._coalesce = coalesce
+        self._cmd_sleep = backoff + pulse
+
+        # Schedule the GPIO commands in the USRP instead of sleeping
+        self._timed = timed
+        self._lead_time = lead_time
+        self._time_key = pmt.intern('time')
+        # Offset of each command of a beam change from the switch instant,
+        # the strobe rises once the BA pins settled and falls after the pulse
+        self._cmd_offsets = (0.0, backoff) if coalesce else \
+            (0.0, backoff, backoff + pulse)
+        # Time from the switch instant to the earliest next beam change,
+        # a strobe left high needs its whole pulse before the next BA write
+        self._cmd_span = backoff + pulse if coalesce else backoff + pulse + backoff
+        # Clock of the USRP driving the GPIOs
+        self._usrp_clock = usrp_clock()
+        # Earliest USRP time for the next beam change, avoids overlaps
+        self._next_cmd_time = 0.0
+        # USRP time of the last beam change we scheduled
+        self._last_cmd_time = None
+        # Host monotonic time for the beam change being handled, if any
+        self._switch_time = None
+        self._untimed_warning = False
 
         logging.basicConfig(
             level=logging.DEBUG if debug else logging.INFO,
@@ -115,7 +151,21 @@ class beam_mapper(gr.basic_block):
         elif rx_mhu in ["MHU2", "mhu2"]:
            self._mhu2['mode'] = "RX"
 
-    def pmt_publish(self, bank, attr, value, mask):
+        # Number of GPIO writes sent and skipped for unchanged beams
+        self.issued_writes = 0
+        self.suppressed_writes = 0
+        # Beam index on the BA pins, shared by both MHUs
+        self._ba_value = 0
+        # BA pins flipped in total, in the last slot, and number of slots
+        self.toggled_bits = 0
+        self.slot_toggles = 0
+        self.slots = 0
+
+        # Prebuild the GPIO commands of every beam of both MHUs
+        self._gpio_table = self._build_gpio_table()
+
+    @staticmethod
+    def gpio_cmd(bank, attr, value, mask):
         """
         Factory function to facilitate the creation of PMT messages
         """
@@ -129,13 +179,131 @@ class beam_mapper(gr.basic_block):
             }
         }
 
-        # Convert GPIO dict to PMT and sent control port message
-        self.message_port_pub(
-            pmt.intern('gpio_cmd'),
-            pmt.to_pmt(gpio)
-        )
+        # Convert GPIO dict to PMT
+        return pmt.to_pmt(gpio)
+
+    def pmt_publish(self, bank, attr, value, mask):
+        """
+        Create a GPIO command and send it to the control port
+        """
+        self.publish_cmd(self.gpio_cmd(bank, attr, value, mask))
+
+    def publish_cmd(self, cmd):
+        """
+        Send a prebuilt GPIO command to the control port
+        """
+        self.message_port_pub(self._gpio_port, cmd)
         # And sleep a little bit
-        sleep(self._backoff + self._pulse)
+        sleep(self._cmd_sleep)
+
+    def set_usrp_time(self, usrp_time, host_time=None):
+        """
+        Anchor the USRP time, in seconds, to the host monotonic clock
+        """
+        previous = self._usrp_clock.anchor
+        self._usrp_clock.set(usrp_time, host_time)
+        self.logging.debug(f'USRP time anchor {self._usrp_clock.anchor}')
+
+        host_now = clock.now()
+        now = self.usrp_time(host_now)
+
+        # The USRP time went back past the last anchor, it was reset, so
+        # forget the last schedule
+        if previous is None or now < previous[0]:
+            self._next_cmd_time = 0.0
+            self._last_cmd_time = None
+
+        # The last change was still ahead with the old anchor, the new one
+        # may tell we scheduled it too late
+        elif self._last_cmd_time is not None and \
+                previous[0] + host_now - previous[1] < self._last_cmd_time < now:
+            self.logging.warning(
+                f'Beam change scheduled at USRP time {self._last_cmd_time:.6f}, ' + \
+                f'{now - self._last_cmd_time:.6f}s in the past'
+            )
+
+    def usrp_time(self, host_time):
+        """
+        Convert an instant of the host monotonic clock to USRP time
+        """
+        return self._usrp_clock.usrp_time(host_time)
+
+    @staticmethod
+    def time_spec(usrp_time):
+        """
+        Create the (full seconds, fractional seconds) pair of UHD commands
+        """
+        full_secs = int(usrp_time)
+        return pmt.make_tuple(
+            pmt.from_uint64(full_secs), pmt.from_double(usrp_time - full_secs)
+        )
+
+    def publish_timed(self, cmds, host_time=None):
+        """
+        Send a sequence of GPIO commands scheduled by the USRP
+        """
+        # Never schedule commands sooner than they can reach the USRP
+        earliest = clock.now() + self._lead_time
+        if host_time is None or host_time < earliest:
+            host_time = earliest
+
+        # Do not overlap with the sequence of the previous beam change
+        start = max(self.usrp_time(host_time), self._next_cmd_time)
+
+        for cmd, offset in zip(cmds, self._cmd_offsets):
+            self.message_port_pub(
+                self._gpio_port,
+                pmt.dict_add(cmd, self._time_key, self.time_spec(start + offset))
+            )
+
+        self._next_cmd_time = start + self._cmd_span
+        self._last_cmd_time = start
+
+    def _build_gpio_table(self):
+        """
+        Map every MHU ID and beam index to its sequence of GPIO commands
+        """
+        # Create the BA and ID masks
+        BA_GPIO_MASK = self._beam_mask << self._beam_push
+        ID_GPIO_MASK = self._id_mask << self._id_push
+
+        gpio_table = {}
+        for mhu_id, mhu_pin in ((1, self._mhu_id_1), (2, self._mhu_id_2)):
+            # Bit push to specify the MHU index, and release it afterwards
+            ID_TOGGLE = 1 << mhu_pin
+            id_high = self.gpio_cmd('FP0', 'OUT', ID_TOGGLE, ID_GPIO_MASK)
+            id_low = self.gpio_cmd('FP0', 'OUT', 0x000, ID_GPIO_MASK)
+
+            # Write the BA value and release the strobe of the previous beam
+            # change in one command, the MHUs latch the BA pins on the rising
+            # edge, which only comes once the BA pins settled
+            if self._coalesce:
+                gpio_table[mhu_id] = [None] + [
+                    (
+                        self.gpio_cmd(
+                            'FP0', 'OUT', beam_index << self._beam_push,
+                            BA_GPIO_MASK | ID_GPIO_MASK
+                        ),
+                        id_high
+                    )
+                    for beam_index in range(1, 64)
+                ]
+                continue
+
+            # Index zero is not a valid beam
+            gpio_table[mhu_id] = [None] + [
+                (
+                    # Bit push with the BA value
+                    self.gpio_cmd(
+                        'FP0', 'OUT', beam_index << self._beam_push, BA_GPIO_MASK
+                    ),
+                    id_high,
+                    id_low
+                )
+                for beam_index in range(1, 64)
+            ]
+
+        return gpio_table
 
     def _setup(self):
         # Default masks, in case they're handy
@@ -164,6 +332,11 @@ class beam_mapper(gr.basic_block):
         # Burn the transmission direction during setup
         self.pmt_publish('FP0', 'OUT', ID_TX_MODE, DI_GPIO_MASK)
 
+        # The beam pins were just cleared, forget the beams we had
+        self._mhu1['beam_index'] = None
+        self._mhu2['beam_index'] = None
+        self._ba_value = 0
+
         self.logging.info(f"GPIO MASK {bin(GPIO_MASK)}")
 
     def start(self):
@@ -196,74 +369,85 @@ class beam_mapper(gr.basic_block):
 
     @tx_beam_index.setter
     def tx_beam_index(self, value):
-        # Sanitize input
-        if not isinstance(value, int) or value not in range(1,64):
-            raise ValueError('Invalid beam value: ' + str(value))
-
-        # If the MHU1 or the MHU2 was set as TX
-        if self._mhu1['mode'] == "TX":
-            # Update class's private variable
-            self._mhu1['beam_index'] = value
-            # Generate GPIO configuration
-            self.configure_gpio(mhu=self._mhu1)
-
-        if self._mhu2['mode'] == "TX":
-            # Update class's private variable
-            self._mhu2['beam_index'] = value
-            # Generate GPIO configuration
-            self.configure_gpio(mhu=self._mhu2)
-
+        self._set_beam_index("TX", value)
 
     @rx_beam_index.setter
     def rx_beam_index(self, value):
+        self._set_beam_index("RX", value)
+
+    def _set_beam_index(self, mode, value):
         # Sanitize input
         if not isinstance(value, int) or value not in range(1,64):
             raise ValueError('Invalid beam value: ' + str(value))
 
-        # If the MHU1 or the MHU2 was set as TX
-        if self._mhu1['mode'] == "RX":
-            # Skip reconfiguration if we can
-            if value != self._mhu1['beam_index']:
-                # Update class's private variable
-                self._mhu1['beam_index'] = value
-                # Generate GPIO configuration
-                self.configure_gpio(mhu=self._mhu1)
+        # If the MHU1 or the MHU2 was set with this mode
+        for mhu in (self._mhu1, self._mhu2):
+            if mhu['mode'] != mode:
+                continue
 
-        if self._mhu2['mode'] == "RX":
             # Skip reconfiguration if we can
-            if value != self._mhu2['beam_index']:
-                # Update class's private variable
-                self._mhu2['beam_index'] = value
-                # Generate GPIO configuration
-                self.configure_gpio(mhu=self._mhu2)
+            if value == mhu['beam_index']:
+                self.suppressed_writes += len(self._gpio_table[mhu['id']][value])
+                continue
+
+            # Update class's private variable
+            mhu['beam_index'] = value
+            # Generate GPIO configuration
+            self.configure_gpio(mhu=mhu)
 
     def configure_gpio(self, mhu):
         # Sanitize input
         if not mhu:
             raise ValueError("Unrecognizable MHU: " + str(mhu))
 
-        # Create the BA mask
-        BA_GPIO_MASK = self._beam_mask << self._beam_push
-        # Bit push with the BA value
-        BA_TOGGLE = int(mhu['beam_index']) << self._beam_push
-        # Convert GPIO dict to PMT and sent control port message
-        self.pmt_publish('FP0', 'OUT', BA_TOGGLE, BA_GPIO_MASK)
+        # Look up the BA write and the ID strobe for this beam
+        cmds = self._gpio_table[mhu['id']][mhu['beam_index']]
+        self.issued_writes += len(cmds)
 
-        # Create new ID mask
-        ID_GPIO_MASK = self._id_mask << self._id_push
-        # Bit push to specify the MHU index
-        ID_TOGGLE =  1 << (self._mhu_id_1 if mhu['id'] == 1 else self._mhu_id_2)
+        # Count the BA pins that flip, their settling dominates the switch
+        self.slot_toggles += bin(self._ba_value ^ mhu['beam_index']).count('1')
+        self._ba_value = mhu['beam_index']
+
+        # Let the USRP time the commands, if we know its time
+        if self._timed and self._usrp_clock.anchored:
+            self.publish_timed(cmds, self._switch_time)
 
-        # Convert GPIO dict to PMT and sent control port message
-        self.pmt_publish('FP0', 'OUT', ID_TOGGLE, ID_GPIO_MASK)
-        self.pmt_publish('FP0', 'OUT', 0x000, ID_GPIO_MASK)
+        else:
+            if self._timed and not self._untimed_warning:
+                self.logging.warning('USRP time not set, sending untimed commands')
+                self._untimed_warning = True
+
+            for cmd in cmds:
+                self.publish_cmd(cmd)
 
         # Print debug information
-        self.logging.debug(
-            f'MHU {mhu["id"]} Beam Index {mhu["beam_index"]} ' + \
-            f'BA GPIO Mask {bin(ID_GPIO_MASK)} BA Toggle {bin(ID_TOGGLE)}' + \
-            f'ID GPIO Mask {bin(BA_GPIO_MASK)} ID Toggle {bin(BA_TOGGLE)}'
-        )
+        if self.logging.isEnabledFor(logging.DEBUG):
+            self.logging.debug(
+                f'MHU {mhu["id"]} Beam Index {mhu["beam_index"]} ' + \
+                f'GPIO commands {self._gpio_table[mhu["id"]][mhu["beam_index"]]}'
+            )
+
+    def get_issued_writes(self):
+        return self.issued_writes
+
+    def get_suppressed_writes(self):
+        return self.suppressed_writes
+
+    def get_toggled_bits(self):
+        return self.toggled_bits
+
+    def get_toggles_per_slot(self):
+        return self.toggled_bits / max(self.slots, 1)
+
+    def usrp_time_msg_handler(self, msg):
+        # Convert message to python
+        p_msg = pmt.to_python(msg)
+
+        # The USRP time, and the host time it was taken at if known
+        if 'usrp_time' not in p_msg:
+            raise ValueError('Missing USRP time: ' + str(p_msg))
+
+        self.set_usrp_time(p_msg['usrp_time'], p_msg.get('time', None))
 
     def beam_id_msg_handler(self, msg):
         # Convert message to python
@@ -272,6 +456,10 @@ class beam_mapper(gr.basic_block):
         # Print debug information
         self.logging.debug(f'Received Beam ID message: {p_msg}')
 
+        # Check if the beam change was scheduled for a given instant
+        self._switch_time = p_msg.get('time', None)
+        self.slot_toggles = 0
+
         # Check if we receive  a beam ID for the TX
         if 'tx' in p_msg:
             self.tx_beam_index = p_msg.get('tx', 32)
@@ -284,3 +472,7 @@ class beam_mapper(gr.basic_block):
         if 'tx' not in p_msg and 'rx' not in p_msg:
             # Raise error
             raise ValueError('Missing references to any antenna: ' + str(p_msg))
+
+        self.slots += 1
+        self.toggled_bits += self.slot_toggles
+        self.logging.debug(f'Toggled {self.slot_toggles} BA bits')
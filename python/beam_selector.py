@@ -20,25 +20,48 @@
 #
 
 import logging
+import os
 import numpy as np
 from gnuradio import gr
 import pmt
-from time import time
+
+from .kpi_stats import beam_kpi_map, beam_history
+from .binary_log import binary_log
+from .timebase import clock
 
 class beam_selector(gr.basic_block):
     """
     Method that selects the best beam for IA
+
+    When beam_sweep runs in bandit mode, the selector also picks every pair
+    to probe, either by upper confidence bound ('ucb') or Thompson sampling
+    ('thompson') over a Gaussian model of the KPI of each pair.
     """
+    # Available bandit algorithms
+    bandits = ('ucb', 'thompson')
+
     def __init__(self,
              pair_file="/home/joao/sel_pair.log",
              kpi_file="/home/joao/sel_kpi.log",
              threshold=0.0,
-             debug=False
+             debug=False,
+             early_stop=0,
+             collapse=10.0,
+             bandit='ucb',
+             exploration=2.0,
+             prior_std=10.0,
+             history_file='',
+             decay=0.5,
+             batched=False
         ):
 
-        # Check if the threshold is not a positiver number
-        if threshold < 0.0:
-            raise ValueError("Negative threshold:" + str(threshold) )
+        # Check if the number of measurements is not a positive number
+        if early_stop < 0:
+            raise ValueError("Negative early stop count:" + str(early_stop))
+
+        # Check whether we know the bandit algorithm
+        if bandit not in self.bandits:
+            raise ValueError("Invalid bandit algorithm: " + str(bandit))
 
         gr.basic_block.__init__(self,
             name="Beam Selector",
@@ -47,6 +70,28 @@ class beam_selector(gr.basic_block):
 
         # Save parameters as class variables
         self._threshold = threshold
+        # Stop the sweep once a pair has this many KPIs above the threshold
+        self._early_stop = early_stop
+        self._early_stopped = False
+
+        # Ask for a new IA if tracking finds the link this much weaker
+        self._collapse = collapse
+        self._tracking = False
+        # KPI of the beam pair chosen by the last IA procedure
+        self._serving_kpi = None
+
+        # Wait for the last KPI batch of a sweep before deciding, which is
+        # also turned on by the first batch that comes in
+        self._batched = batched
+        self._batch_done = False
+        self._pending_decision = None
+
+        # Bandit algorithm, weight of the confidence bound and least spread
+        # assumed for the KPIs of pairs we did not probe yet
+        self._bandit = bandit
+        self._exploration = exploration
+        self._prior_std = prior_std
+        self._rng = np.random.default_rng()
 
         logging.basicConfig(
             level=logging.DEBUG if debug else logging.INFO,
@@ -54,25 +99,59 @@ class beam_selector(gr.basic_block):
         )
         self.logging = logging.getLogger(self.name())
 
+        self.trigger = False
+        # Number of the current IA, which may take several stages
         self._sel_counter = 0
+        self._ia_done = True
         self._kpi_counter = 0
-        self._beam_store = {}
+        # Running statistics of the KPIs of each beam pair
+        self._beam_store = beam_kpi_map()
+        # Candidate pairs of the current bandit IA, as TX and RX index grids
+        self._candidates = None
+        # Number of times each pair was probed and the probing order
+        self._probes = np.zeros((self._beam_store.size,) * 2, dtype=np.int64)
+        self._probe_trace = []
+        # Probes and estimated regret of the last bandit IA
+        self.bandit_stats = {}
+
+        # Decayed KPI of each pair across sweeps, kept across restarts
+        self._history = beam_history(decay=decay)
+        self._history_file = history_file
+        if history_file and os.path.exists(history_file):
+            self._history.load(history_file)
+            self.logging.info(
+                f'Loaded the history of {np.count_nonzero(self._history.valid)} ' + \
+                f'beam pairs from {history_file}'
+            )
 
         # Register message port
         self.message_port_register_in(pmt.intern('trigger'))
         self.message_port_register_in(pmt.intern('kpi_in'))
+        self.message_port_register_in(pmt.intern('probe'))
         self.message_port_register_out(pmt.intern('sweep'))
 
         # Assign sweep CTL message handler
         self.set_msg_handler(pmt.intern('trigger'), self.trigger_msg_handler)
         self.set_msg_handler(pmt.intern('kpi_in'), self.val_msg_handler)
+        self.set_msg_handler(pmt.intern('probe'), self.probe_msg_handler)
+
+        # Open the logs of the decisions and of the KPIs
+        self.results = binary_log(pair_file, (
+            ('ia', 'u4'), ('tx', 'u1'), ('rx', 'u1'), ('kpi', 'f4'), ('elapsed', 'f4')
+        ))
 
-        # Open file and add headers
-        self.results = open(pair_file, "w")
-        self.results.write("#,TX,RX,KPI,elapsed\n")
+        self.kpi = binary_log(kpi_file, (
+            ('n', 'u4'), ('tx', 'u1'), ('rx', 'u1'), ('kpi', 'f4')
+        ))
 
-        self.kpi = open(kpi_file, "w")
-        self.kpi.write("#,TX,RX,KPI\n")
+    def start(self):
+        """
+        Called at the beginning of the flowgraph execution to allocate resources
+        """
+        # Let the sweep start with what we learned in previous runs
+        self.publish_ranking()
+
+        return gr.basic_block.start(self)
 
     def stop(self):
         """
@@ -81,8 +160,51 @@ class beam_selector(gr.basic_block):
         self.results.close()
         self.kpi .close()
 
+        if self._history_file:
+            self._history.save(self._history_file)
+
         return gr.basic_block.stop(self)
 
+    def get_kpi_map(self):
+        """
+        Views of the KPI statistics of every beam pair, indexed by TX and RX
+        """
+        return self._beam_store.export()
+
+    def get_bandit_stats(self):
+        return self.bandit_stats
+
+    def get_history(self):
+        """
+        Decayed KPI and weight of every beam pair, indexed by TX and RX
+        """
+        return {'kpi': self._history.kpi, 'weight': self._history.weight}
+
+    def remember(self):
+        """
+        Fold the KPIs of the last sweep into the history and share the ranking
+        """
+        self._history.merge(self._beam_store)
+        self.publish_ranking()
+
+    def publish_ranking(self):
+        """
+        Tell the sweep which beam pairs to probe first
+        """
+        tx_rank, rx_rank = self._history.ranking()
+
+        if not len(tx_rank):
+            return
+
+        self.message_port_pub(
+            pmt.intern('sweep'),
+            pmt.to_pmt({
+                "rank": {
+                    'tx': tx_rank.astype(np.uint8),
+                    'rx': rx_rank.astype(np.uint8)
+                }
+            })
+        )
 
     def val_msg_handler(self, msg):
         # Convert message to python
@@ -92,20 +214,165 @@ class beam_selector(gr.basic_block):
 
         # Check if we receive a new sweep state
         kpi = p_msg.get('val', -999.0)
+
+        # Batches carry vectors of KPIs and beams
+        if isinstance(kpi, np.ndarray):
+            self.ingest(p_msg)
+            return
+
         # Check if we receive  a beam ID for the TX
         tx_beam = p_msg.get('tx', 32)
         # Check if we receive  a beam ID for the RX
         rx_beam = p_msg.get('rx', 32)
 
-        # Check if we need to create a new entry in the beam store
-        if (tx_beam, rx_beam) not in self._beam_store:
-            self._beam_store[(tx_beam, rx_beam)] = []
-
         if self.trigger:
-            self._beam_store[(tx_beam, rx_beam)].append(kpi)
+            self._beam_store.update(tx_beam, rx_beam, kpi)
+
+            # Check whether this pair is good enough to stop the sweep
+            if self._early_stop and not self._early_stopped and \
+                    self._beam_store.count[tx_beam, rx_beam] >= self._early_stop and \
+                    self._beam_store.robust_at(tx_beam, rx_beam) > self._threshold:
+                self.stop_early(tx_beam, rx_beam)
 
         self._kpi_counter += 1
-        self.kpi.write(f"{self._kpi_counter},{tx_beam},{rx_beam},{kpi}\n")
+        self.kpi.write(self._kpi_counter, tx_beam, rx_beam, kpi)
+
+    def ingest(self, p_msg):
+        """
+        Add a batch of KPIs at once
+        """
+        # The KPIs come in batches, wait for the last one of every sweep
+        self._batched = True
+
+        kpi = p_msg['val']
+        tx_beam = np.asarray(p_msg['tx'], dtype=np.intp)
+        rx_beam = np.asarray(p_msg['rx'], dtype=np.intp)
+
+        if len(kpi) and (self.trigger or self._pending_decision is not None):
+            self._beam_store.update(tx_beam, rx_beam, kpi)
+
+            # Check whether any pair of the batch is good enough to stop
+            if self._early_stop and not self._early_stopped:
+                robust = self._beam_store.robust()[tx_beam, rx_beam]
+                good = (self._beam_store.count[tx_beam, rx_beam] >= self._early_stop) & \
+                    (robust > self._threshold)
+
+                if good.any():
+                    index = np.argmax(np.where(good, robust, -np.inf))
+                    self.stop_early(int(tx_beam[index]), int(rx_beam[index]))
+
+        self.kpi.write_batch(
+            np.arange(self._kpi_counter + 1, self._kpi_counter + len(kpi) + 1),
+            tx_beam, rx_beam, kpi
+        )
+        self._kpi_counter += len(kpi)
+
+        # The last batch of the sweep, make the decision we held back
+        if p_msg.get('end', False):
+            self._batch_done = True
+
+            if self._pending_decision is not None:
+                pending, self._pending_decision = self._pending_decision, None
+
+                # Unless the batch was good enough to stop early
+                if self._early_stopped:
+                    self.remember()
+                else:
+                    self.decide(pending)
+
+    def stop_early(self, tx_beam, rx_beam):
+        """
+        Abort the sweep and use a beam pair that is good enough
+        """
+        self._early_stopped = True
+        kpi = self._beam_store.robust_at(tx_beam, rx_beam)
+
+        # Report findings
+        self.logging.info(f'Early stop with pair TX {tx_beam} RX {rx_beam} RSS {kpi}')
+
+        # Use the beam right away
+        self.message_port_pub(
+            pmt.intern('sweep'),
+            pmt.to_pmt({
+                "set_beam": {'tx': tx_beam, 'rx': rx_beam},
+                "kpi": kpi,
+                "early_stop": True
+            })
+        )
+
+        self.results.write(self._sel_counter, tx_beam, rx_beam, kpi, 0.0)
+
+    def next_probe(self):
+        """
+        Ask the sweep to probe the candidate pair with the highest score
+        """
+        if self._candidates is None:
+            raise ValueError('Probe requested outside of a bandit IA')
+
+        tx_grid, rx_grid = self._candidates
+        probes = self._probes[tx_grid, rx_grid]
+        mean = self._beam_store.mean[tx_grid, rx_grid]
+        measured = self._beam_store.count[tx_grid, rx_grid] > 0
+
+        if measured.any():
+            # Pairs we did not probe yet start from the average KPI, spread
+            # as much as the measured pairs are
+            prior = mean[measured].mean()
+            spread = max(self._prior_std, mean[measured].std())
+            # Probes without KPIs were below the sensitivity
+            mean = np.where(measured, mean, mean[measured].min())
+        else:
+            prior = 0.0
+            spread = self._prior_std
+
+        # Pooled spread of the KPIs of a single pair
+        repeated = self._beam_store.count > 1
+        noise = np.sqrt(self._beam_store.variance[repeated].mean()) \
+            if repeated.any() else 1.0
+        noise = max(noise, 1e-3)
+
+        # Gaussian posterior of the mean KPI of each pair
+        precision = 1.0 / spread ** 2 + probes / noise ** 2
+        post_mean = (prior / spread ** 2 + probes * mean / noise ** 2) / precision
+        post_std = 1.0 / np.sqrt(precision)
+
+        if self._bandit == 'ucb':
+            score = post_mean + self._exploration * post_std
+            # Break ties at random instead of by beam index
+            score += 1e-9 * self._rng.random(score.shape)
+        else:
+            score = self._rng.normal(post_mean, post_std)
+
+        index = np.unravel_index(np.argmax(score), score.shape)
+        tx_beam, rx_beam = int(tx_grid[index]), int(rx_grid[index])
+
+        self._probes[tx_beam, rx_beam] += 1
+        self._probe_trace.append((tx_beam, rx_beam))
+
+        self.message_port_pub(
+            pmt.intern('sweep'),
+            pmt.to_pmt({"probe": {'tx': tx_beam, 'rx': rx_beam}})
+        )
+
+    def regret(self):
+        """
+        Estimated KPI lost by probing other pairs than the best one
+
+        Uses the final mean KPI of each pair, ignoring probes without KPIs.
+        """
+        tx_beams, rx_beams = np.array(self._probe_trace, dtype=np.intp).T
+        mean = self._beam_store.mean[tx_beams, rx_beams]
+        measured = self._beam_store.count[tx_beams, rx_beams] > 0
+
+        if not measured.any():
+            return 0.0
+
+        return float(np.sum(mean[measured].max() - mean[measured]))
+
+    def probe_msg_handler(self, msg):
+        # The sweep asks for the next pair of a bandit IA
+        self.logging.debug(f'Received probe message: {pmt.to_python(msg)}')
+        self.next_probe()
 
     def trigger_msg_handler(self, msg):
         # Convert message to python
@@ -121,45 +388,116 @@ class beam_selector(gr.basic_block):
         # Set the new value
         self.trigger = p_msg.get('trigger', True)
 
+        # Tracking rounds belong to the IA of the pair they track
+        tracking = p_msg.get('tracking', False)
+
+        # The last stage of an IA closes it, the next trigger starts a new one
+        if not self.trigger and not tracking:
+            self._ia_done = p_msg.get('final', True)
+
         # When triggered, reset saved information
         if self.trigger:
-            self._sel_counter += 1
-            self._beam_store = {}
+            # Stages of the same IA share its number
+            if self._ia_done and not tracking:
+                self._sel_counter += 1
+                self._ia_done = False
+            self._beam_store.reset()
+            self._early_stopped = False
+            self._tracking = tracking
+
+            # Bandit IAs tell us the pairs we can pick from
+            bandit = p_msg.get('bandit', None)
+            self._candidates = None if bandit is None else np.meshgrid(
+                np.asarray(bandit['tx'], dtype=np.intp),
+                np.asarray(bandit['rx'], dtype=np.intp),
+                indexing='ij'
+            )
+            self._probes.fill(0)
+            self._probe_trace = []
+            self._batch_done = False
+            self._pending_decision = None
+
+        # The sweep already got a beam pair
+        elif self._early_stopped:
+            self.remember()
+
+        # Wait for the KPIs of the end of the sweep
+        elif self._batched and not self._batch_done:
+            self._pending_decision = p_msg
+
+        else:
+            self.decide(p_msg)
+
+    def decide(self, p_msg):
+        """
+        Pick the best beam pair of the sweep and hand it over
+        """
+        start = clock.now()
+        # Extract the beam pair with highest median KPI
+        best = self._beam_store.best()
+
+        if best:
+            tx_beam, rx_beam, kpi = best
+
+        # Measure elapsed time
+        elapsed = clock.now() - start
+
+        decision = {"reacquire": False}
+
+        # Compare the cost of a bandit IA to an exhaustive sweep
+        if self._probe_trace:
+            self.bandit_stats = {
+                'probes': len(self._probe_trace),
+                'pairs': int(np.count_nonzero(self._probes)),
+                'candidates': self._candidates[0].size,
+                'regret': self.regret()
+            }
+            self.logging.info(
+                f'Bandit IA probed {self.bandit_stats["pairs"]} of ' + \
+                f'{self.bandit_stats["candidates"]} pairs in ' + \
+                f'{self.bandit_stats["probes"]} probes, ' + \
+                f'regret {self.bandit_stats["regret"]}'
+            )
+            decision["probes"] = self.bandit_stats['probes']
+            decision["regret"] = self.bandit_stats['regret']
+
+        # When tracking, check whether the link collapsed
+        decision["reacquire"] = self._tracking and (
+            not best or self._serving_kpi is None or
+            kpi < self._serving_kpi - self._collapse
+        )
+
+        if best:
+            # Report findings
+            self.logging.info(f'Pair TX {tx_beam} RX {rx_beam} RSS {kpi} Time {elapsed}')
+
+            # Keep the KPI of the IA procedure as the tracking reference
+            if not self._tracking and p_msg.get('final', True):
+                self._serving_kpi = kpi
+
+            # Use the best beam
+            self.message_port_pub(
+                pmt.intern('sweep'),
+                pmt.to_pmt(dict(
+                    decision,
+                    set_beam={'tx': tx_beam, 'rx': rx_beam},
+                    kpi=kpi
+                ))
+            )
+
+            self.results.write(self._sel_counter, tx_beam, rx_beam, kpi, elapsed)
 
         else:
-            start = time()
-            # Get the average KPI values per beam pair
-            for beam_pair in self._beam_store:
-                self._beam_store[beam_pair] = np.median(self._beam_store[beam_pair])
-
-            if self._beam_store:
-                # Extract the beam pair with highest KPI
-                tx_beam, rx_beam = max(self._beam_store, key=self._beam_store.get)
-                kpi = self._beam_store[(tx_beam, rx_beam)]
-
-            # Measure elapsed time
-            elapsed = time() - start
-
-            if self._beam_store:
-                # Report findings
-                self.logging.info(f'Pair TX {tx_beam} RX {rx_beam} RSS {kpi} Time {elapsed}')
-
-                # Use the best beam
-                self.message_port_pub(
-                    pmt.intern('sweep'),
-                    pmt.to_pmt({"set_beam": {'tx': tx_beam, 'rx': rx_beam}})
-                )
-
-                self.results.write(f"{self._sel_counter},{tx_beam},{rx_beam},{kpi},{elapsed}\n")
-
-            else:
-                # Report findings
-                self.logging.info(f'Failed IA, resetting to boresight')
-
-                # Use the best beam
-                self.message_port_pub(
-                    pmt.intern('sweep'),
-                    pmt.to_pmt({"set_beam": {'tx': 32, 'rx': 32}})
-                )
-
-                self.results.write(f"{self._sel_counter},0,0,0,{elapsed}\n")
+            # Report findings
+            self.logging.info(f'Failed IA, resetting to boresight')
+
+            # Use the best beam
+            self.message_port_pub(
+                pmt.intern('sweep'),
+                pmt.to_pmt(dict(decision, set_beam={'tx': 32, 'rx': 32}))
+            )
+
+            self.results.write(self._sel_counter, 0, 0, 0.0, elapsed)
+
+        # Learn from this sweep for the next ones
+        self.remember()
@@ -26,20 +26,39 @@ import pmt
 from time import sleep
 from threading import Thread, Event
 
-from datetime import datetime
+from . import sweep_plan
+from .timebase import clock
 
 
 class beam_sweep(gr.basic_block):
     """
     docstring for block beam_sweep
     """
+    # Available search strategies
+    modes = ('exhaustive', 'hierarchical', 'decoupled', 'bandit')
+
     def __init__(self,
                  standalone=False,
                  tx_iterable=[32],
                  rx_iterable=[32],
                  beam_period=0.1,
                  interval=5,
-                 debug=False):
+                 debug=False,
+                 decision_timeout=1.0,
+                 fallback_beam=(32, 32),
+                 lookahead=0.0,
+                 mode='exhaustive',
+                 stages=(8, 2, 1),
+                 reference_every=0,
+                 iterations=1,
+                 track_period=0.0,
+                 track_radius=1,
+                 neighbor_graph=None,
+                 min_interval=0.0,
+                 budget=64,
+                 warm_start=False,
+                 order='nested',
+                 auto_dwell=False):
 
         gr.basic_block.__init__(
             self,
@@ -57,6 +76,14 @@ class beam_sweep(gr.basic_block):
             raise TypeError("Could not create the RX iterator from:",
                             rx_iterable)
 
+        # Check whether we know the search strategy
+        if mode not in self.modes:
+            raise ValueError('Invalid sweep mode: ' + str(mode))
+
+        # Check whether we know the sweep order
+        if order not in sweep_plan.orders:
+            raise ValueError('Invalid sweep order: ' + str(order))
+
         # Find out who it the outer iterable
         self._outer_iterable = tx_iterable
         self._inner_iterable = rx_iterable
@@ -67,10 +94,50 @@ class beam_sweep(gr.basic_block):
         self._tx_change_iterable = False
         self._rx_change_iterable = False
 
+        # Dwell of every slot: seconds, a sequence with the dwell of each slot
+        # of a stage, or a callable taking the TX and RX beams
         self._beam_period = beam_period
+        # Shortest safe dwell, as calibrated by the KPI aggregator
+        self._min_dwell = 0.0
+        # Dwell exactly that long once it is known
+        self._auto_dwell = auto_dwell
+        # Longest and shortest time between IAs, the KPI monitor can ask for
+        # an IA anywhere in between
         self._interval = interval
+        self._min_interval = min_interval
         self.standalone = standalone
 
+        # How long to wait for the selector before using the fallback beam
+        self._decision_timeout = decision_timeout
+        self._fallback_beam = {'tx': fallback_beam[0], 'rx': fallback_beam[1]}
+
+        # Publish each slot this early, along with the instant it starts
+        self._lookahead = lookahead
+
+        # Search strategy and the strides of the hierarchical stages
+        self._mode = mode
+        self._stages = stages
+        # Number of TX then RX rounds of the decoupled search
+        self._iterations = iterations
+        # Number of pairs the selector can ask us to probe per bandit IA
+        self._budget = budget
+        # Probe the pairs the selector ranks best first
+        self._warm_start = warm_start
+        self._rank = []
+        # Order of the pairs within a stage, and the pair the neighbor-first
+        # order starts from
+        self._order = order
+        self._center = tuple(fallback_beam)
+
+        # Probe the neighbors of the current pair this often between IAs
+        self._track_period = track_period
+        self._track_radius = track_radius
+        self._neighbor_graph = neighbor_graph
+        # Number of slots spent tracking since the start
+        self.track_slots = 0
+        # Run an exhaustive sweep every few IAs to measure the search loss
+        self._reference_every = reference_every
+
         logging.basicConfig(
             level=logging.DEBUG if debug else logging.INFO,
             format='[%(levelname)s] [%(name)s] %(message)s'
@@ -83,25 +150,56 @@ class beam_sweep(gr.basic_block):
         # Control flag to keep thread alive
         self._finished = Event()
         self.new_set_beam = None
+        self.new_set_regret = None
         self._counter = 0
 
+        # Estimate of how long it takes to publish a beam, in seconds
+        self._publish_latency = 0.0
+        # How late each slot of the last sweep started, in seconds
+        self.slot_lateness = np.zeros(0)
+
+        # Handoff between the selector's decision and the sweep thread
+        self._new_beam = Event()
+        # Flag to abort the current sweep, also set when stopping
+        self._abort = Event()
+        # Flag to start a new IA procedure right away
+        self._reacquire = Event()
+        # Handoff between the selector's next probe and the sweep thread
+        self._probe_ready = Event()
+        self._probe = None
+        self._decision_time = None
+        # Time between receiving the decision and applying it, in seconds
+        self.decision_latency = None
+        # KPI of the last decision, when the selector reports it
+        self.new_set_kpi = None
+        # Slots, speedup and loss of the last IA procedure
+        self._ia_slots = 0
+        self.ia_stats = {}
+        self._reference_kpi = None
+
         # Register message port
         self.message_port_register_in(pmt.intern('sweep'))
         self.message_port_register_out(pmt.intern('beam_id'))
         self.message_port_register_out(pmt.intern('trigger'))
+        self.message_port_register_out(pmt.intern('probe'))
 
         # Assign sweep CTL message handler
         self.set_msg_handler(pmt.intern('sweep'), self.sweep_msg_handler)
 
-    def pmt_publish(self, tx_index, rx_index):
+    def pmt_publish(self, tx_index, rx_index, switch_time=None, dwell=None):
         """
         Factory function to facilitate the creation of PMT messages
         """
+        beam_dict = {"tx": tx_index , "rx": rx_index}
+        # Host monotonic instant at which the beam pair should be applied
+        if switch_time is not None:
+            beam_dict["time"] = switch_time
+        # How long the sweep stays on the beam pair, in seconds
+        if dwell is not None:
+            beam_dict["dwell"] = dwell
+
         # Convert GPIO dict to PMT and sent control port message
-        self.message_port_pub(
-            pmt.intern('beam_id'),
-            pmt.to_pmt({"tx": tx_index , "rx": rx_index})
-        )
+        self.message_port_pub(pmt.intern('beam_id'), pmt.to_pmt(beam_dict))
 
 
     def start(self):
@@ -119,14 +217,252 @@ class beam_sweep(gr.basic_block):
         """
         Called at the end of the flowgraph execution to free resources
         """
-        # Toggle flag to stop thread and join it
+        # Toggle flag to stop thread, wake it up and join it
         self._finished.set()
+        self._abort.set()
+        self._reacquire.set()
+        self._probe_ready.set()
+        self._new_beam.set()
         self._thread.join()
 
         #  self.log.close()
 
         return gr.basic_block.stop(self)
 
+    def dwell(self, position, tx_index, rx_index):
+        """
+        Dwell of a slot of a stage, never shorter than the calibrated minimum
+        """
+        if self._auto_dwell and self._min_dwell:
+            return self._min_dwell
+
+        if callable(self._beam_period):
+            period = self._beam_period(tx_index, rx_index)
+
+        elif hasattr(self._beam_period, '__len__'):
+            period = self._beam_period[position % len(self._beam_period)]
+
+        else:
+            period = self._beam_period
+
+        return max(float(period), self._min_dwell)
+
+    def run_slots(self, slots):
+        """
+        Dwell on each (TX, RX) pair on a grid of absolute monotonic deadlines
+        """
+        lateness = []
+        # Every slot starts at a fixed offset from the start of the sweep,
+        # leaving room to pre-queue the first one as well
+        start = clock.now() + self._lookahead
+        deadline = start
+
+        # Only take the next slot when it is due, as it may be chosen on the
+        # fly from the KPIs of the previous ones
+        slots = iter(slots)
+
+        while True:
+            # Pre-queue the slot ahead of time if the mapper can time it
+            publish_time = deadline - self._lookahead
+
+            # Wake up early enough for the beam to be out by the deadline
+            self._abort.wait(publish_time - self._publish_latency - clock.now())
+
+            if self._finished.is_set() or self._abort.is_set():
+                break
+
+            slot = next(slots, None)
+            if slot is None:
+                break
+            tx_index, rx_index = slot
+            position = len(lateness)
+
+            period = self.dwell(position, tx_index, rx_index)
+
+            # Sweep to the next beam
+            before = clock.now()
+            self.pmt_publish(
+                tx_index=tx_index,
+                rx_index=rx_index,
+                switch_time=deadline if self._lookahead else None,
+                dwell=period
+            )
+            after = clock.now()
+
+            # Track the publishing time with a moving average
+            self._publish_latency += 0.1 * (after - before - self._publish_latency)
+            # Positive values mean the beam was published after its deadline
+            lateness.append(after - publish_time)
+
+            # Wait the beam period, without accumulating our own overhead
+            deadline += period
+
+        # Wait until the end of the last slot
+        self._abort.wait(deadline - clock.now())
+
+        self.slot_lateness = np.array(lateness)
+
+        if lateness:
+            self.logging.info(
+                f'Swept {len(lateness)} slots in {clock.now() - start:.6f}s ' + \
+                f'(scheduled {deadline - start:.6f}s) ' + \
+                f'lateness mean {self.slot_lateness.mean():.6f}s ' + \
+                f'max {self.slot_lateness.max():.6f}s'
+            )
+
+        return len(lateness)
+
+    def run_stage(self, slots, final=True, **info):
+        """
+        Sweep a sequence of beam pairs and wait for the selector's decision
+
+        Extra keyword arguments go out with the trigger that starts the stage.
+        """
+        # Discard any stale decision from the previous stage
+        self._new_beam.clear()
+        self._abort.clear()
+        self.new_set_beam = None
+        self.new_set_kpi = None
+        self.new_set_regret = None
+
+        # Bandit probes come on the fly, sort every other stage
+        if isinstance(slots, list):
+            slots = sweep_plan.ordered(
+                slots, self._order, self._center, self._neighbor_graph
+            )
+
+            # Start with the most likely winners
+            if self._warm_start and self._rank:
+                slots = sweep_plan.ranked(slots, self._rank)
+
+        # Let's get the party started
+        self.message_port_pub(
+            pmt.intern('trigger'),
+            pmt.to_pmt(dict(info, trigger=True))
+        )
+
+        self._ia_slots += self.run_slots(slots)
+
+        # Stop the sweeping, for good if the selector stopped us early, and
+        # tell whether it was only tracking the current pair
+        self.message_port_pub(
+            pmt.intern('trigger'),
+            pmt.to_pmt({
+                'trigger': False,
+                'final': final or self._abort.is_set(),
+                'tracking': info.get('tracking', False)
+            })
+        )
+
+        # Block until the selector hands us the best beam
+        if not self._new_beam.wait(self._decision_timeout):
+            self.logging.warning(
+                f'No decision after {self._decision_timeout}s, ' + \
+                f'using fallback beam {self._fallback_beam}'
+            )
+            self._decision_time = clock.now()
+            self.new_set_beam = self._fallback_beam
+
+        if self._finished.is_set():
+            return None
+
+        return self.new_set_beam
+
+    def exhaustive(self):
+        """
+        Sweep every TX and RX beam pair
+        """
+        return self.run_stage(
+            sweep_plan.exhaustive(self._outer_iterable, self._inner_iterable)
+        )
+
+    def hierarchical(self):
+        """
+        Sweep a sparse grid of beam pairs and refine around the best one
+        """
+        center = None
+        radius = None
+
+        for stage, stride in enumerate(self._stages):
+            decision = self.run_stage(
+                sweep_plan.hierarchical_stage(
+                    self._outer_iterable, self._inner_iterable,
+                    stride, center, radius
+                ),
+                final=stage == len(self._stages) - 1
+            )
+
+            # Nothing else to do if stopping or the selector stopped us early
+            if decision is None or self._abort.is_set():
+                break
+
+            # Zoom in around the best pair of this stage
+            center = (decision['tx'], decision['rx'])
+            radius = stride
+
+        return decision
+
+    def decoupled(self):
+        """
+        Sweep the TX beams with a fixed RX beam, then the RX beams
+        """
+        # Start with the RX on the fallback (boresight) beam
+        decision = dict(self._fallback_beam)
+
+        for iteration in range(self._iterations):
+            # Find the best TX beam for the current RX beam
+            decision = self.run_stage(
+                sweep_plan.tx_stage(self._outer_iterable, decision['rx']),
+                final=False
+            )
+
+            # Nothing else to do if stopping or the selector stopped us early
+            if decision is None or self._abort.is_set():
+                break
+
+            # Find the best RX beam for the best TX beam
+            decision = self.run_stage(
+                sweep_plan.rx_stage(decision['tx'], self._inner_iterable),
+                final=iteration == self._iterations - 1
+            )
+
+            if decision is None or self._abort.is_set():
+                break
+
+        return decision
+
+    def bandit(self):
+        """
+        Let the selector pick each pair to probe from the KPIs so far
+        """
+        return self.run_stage(
+            self.probes(),
+            bandit={
+                'tx': [int(beam) for beam in self._outer_iterable],
+                'rx': [int(beam) for beam in self._inner_iterable]
+            }
+        )
+
+    def probes(self):
+        """
+        Ask the selector for the next pair to probe, up to the budget
+        """
+        for _ in range(self._budget):
+            self._probe_ready.clear()
+            self.message_port_pub(pmt.intern('probe'), pmt.to_pmt({'probe': True}))
+
+            # Settle with what we have if the selector does not answer
+            if not self._probe_ready.wait(self._decision_timeout):
+                self.logging.warning(
+                    f'No probe after {self._decision_timeout}s, ending the IA'
+                )
+                return
+
+            if self._finished.is_set():
+                return
+
+            yield self._probe['tx'], self._probe['rx']
+
     def sweep(self):
         sleep(0.1)
         """
@@ -134,14 +470,6 @@ class beam_sweep(gr.basic_block):
         """
         # While our thread is going on
         while not self._finished.is_set():
-            if not self.standalone:
-                # Increment counter
-                self._counter += 1
-                # Report state
-                self.logging.info(f'Start the IA procedure #{self._counter}')
-                # Let's get the party started
-                self.message_port_pub(pmt.intern('trigger'), pmt.to_pmt({'trigger': True}))
-
             # Handle changing iterables at every loop
             if self._tx_change_iterable:
                 self._outer_iterable = self._temp_outer_iterable
@@ -151,37 +479,138 @@ class beam_sweep(gr.basic_block):
                 self._inner_iterable = self._temp_inner_iterable
                 self._rx_change_iterable = False
 
-            # Cycle through the outer loop
-            for outer_index in self._outer_iterable:
-                # Cycle through the inner loop
-                for inner_index in self._inner_iterable:
-                    # Sweep to the next beam
-                    self.pmt_publish(tx_index=outer_index, rx_index=inner_index)
-                    # Wait the beam period
-                    self._finished.wait(self._beam_period)
+            # Without a selector, just keep sweeping
+            if self.standalone:
+                self.run_slots(
+                    sweep_plan.exhaustive(self._outer_iterable, self._inner_iterable)
+                )
+                continue
+
+            # Increment counter
+            self._counter += 1
+            self._ia_slots = 0
+            self._reacquire.clear()
+            # Report state
+            self.logging.info(f'Start the IA procedure #{self._counter}')
+
+            # Every so often, use an exhaustive sweep as a reference
+            mode = self._mode
+            if self._reference_every and self._counter % self._reference_every == 0:
+                mode = 'exhaustive'
+
+            # Run the search strategy until it settles on a beam pair
+            decision = getattr(self, mode)()
+
+            if decision is None:
+                break
+
+            # Report state
+            self.logging.info(f'Stop the IA procedure #{self._counter}')
+
+            # Select the best beam so far
+            self.pmt_publish(tx_index=decision['tx'], rx_index=decision['rx'])
+            self._center = (decision['tx'], decision['rx'])
+            # Measure how long the link waited for the decision
+            self.decision_latency = clock.now() - self._decision_time
+            self.logging.debug(
+                f'Decision-to-apply latency {self.decision_latency}'
+            )
+
+            self.report(mode)
+
+            # Wait the reconfiguration time
+            self.hold(decision)
+            # Toggle variable back off
+            self.new_set_beam = None
+
+    def hold(self, decision):
+        """
+        Stay on a beam pair until the next IA, tracking it if enabled
+        """
+        start = clock.now()
+        end = start + self._interval
+
+        while not self._finished.is_set():
+            remaining = end - clock.now()
 
-            if not self.standalone:
-                # Stop the sweeping
-                self.message_port_pub(pmt.intern('trigger'), pmt.to_pmt({'trigger': False}))
+            if remaining <= 0:
+                return
 
-                # Report state
-                self.logging.info(f'Stop the IA procedure #{self._counter}')
+            # Sleep until the next probe, unless asked to start an IA
+            if self._reacquire.wait(
+                    min(self._track_period, remaining) if self._track_period
+                    else remaining):
+                if not self._finished.is_set():
+                    self.logging.info('Link lost, starting a new IA procedure')
+                    # But not sooner than the minimum interval
+                    self._finished.wait(start + self._min_interval - clock.now())
+                return
 
-                while not self.new_set_beam and not self._finished.is_set():
-                    sleep(1e-9)
+            if not self._track_period or clock.now() >= end:
+                continue
 
-                if self._finished.is_set():
-                    break
+            # Keep the new pair, unless we are stopping
+            decision = self.track(decision) or decision
 
-                # Select the best beam so far
-                self.pmt_publish(
-                    tx_index=self.new_set_beam['tx'],
-                    rx_index=self.new_set_beam['rx']
-                )
-                # Wait the reconfiguration time
-                self._finished.wait(self._interval)
-                # Toggle variable back off
-                self.new_set_beam = None
+    def track(self, decision):
+        """
+        Probe the neighbors of the current beam pair and move if one is better
+        """
+        slots = self._ia_slots
+        current = (decision['tx'], decision['rx'])
+
+        new_decision = self.run_stage(
+            sweep_plan.tracking_stage(
+                self._outer_iterable, self._inner_iterable,
+                current, self._track_radius, self._neighbor_graph
+            ),
+            tracking=True
+        )
+        self.track_slots += self._ia_slots - slots
+
+        if new_decision is None:
+            return None
+
+        # Go back to the current pair, or move to a better one
+        if (new_decision['tx'], new_decision['rx']) != current:
+            self.logging.info(
+                f'Tracking moved from {current} to ' + \
+                f'{(new_decision["tx"], new_decision["rx"])}'
+            )
+
+        self.pmt_publish(tx_index=new_decision['tx'], rx_index=new_decision['rx'])
+        self._center = (new_decision['tx'], new_decision['rx'])
+
+        return new_decision
+
+    def report(self, mode):
+        """
+        Compare the cost and the outcome of the last IA to an exhaustive sweep
+        """
+        exhaustive_slots = len(self._outer_iterable) * len(self._inner_iterable)
+
+        # Only an exhaustive sweep that covered every slot is a reference
+        if mode == 'exhaustive' and not self._abort.is_set() and \
+                self._ia_slots == exhaustive_slots:
+            self._reference_kpi = self.new_set_kpi
+
+        self.ia_stats = {
+            'mode': mode,
+            'slots': self._ia_slots,
+            'speedup': exhaustive_slots / max(self._ia_slots, 1),
+            'kpi': self.new_set_kpi,
+            # Estimated KPI lost while probing, only known to bandit IAs
+            'regret': self.new_set_regret,
+            # KPI lost compared to the last exhaustive reference sweep
+            'loss': None if self.new_set_kpi is None or self._reference_kpi is None
+                else self._reference_kpi - self.new_set_kpi
+        }
+
+        self.logging.info(
+            f'IA #{self._counter} {mode} swept {self._ia_slots} slots ' + \
+            f'speedup {self.ia_stats["speedup"]:.2f} ' + \
+            f'KPI {self.ia_stats["kpi"]} loss {self.ia_stats["loss"]}'
+        )
 
     def sweep_msg_handler(self, msg):
         # Convert message to python
@@ -189,13 +618,51 @@ class beam_sweep(gr.basic_block):
         # Print debug information
         self.logging.debug(f'Received sweep message: {p_msg}')
 
+        # The selector chose the next pair of a bandit IA
+        if 'probe' in p_msg:
+            self._probe = p_msg['probe']
+            self._probe_ready.set()
+            return
+
+        # The selector ranked the beam pairs by their KPI history
+        if 'rank' in p_msg:
+            self._rank = list(zip(
+                (int(beam) for beam in p_msg['rank']['tx']),
+                (int(beam) for beam in p_msg['rank']['rx'])
+            ))
+            return
+
+        # The KPI aggregator calibrated how long the RSS takes to settle
+        if 'min_dwell' in p_msg:
+            self._min_dwell = float(p_msg['min_dwell'])
+            self.logging.info(f'Minimum dwell set to {self._min_dwell:.6f}s')
+            return
+
+        # The KPI monitor only asks for a new IA procedure
+        if 'set_beam' not in p_msg and p_msg.get('reacquire', False):
+            self._reacquire.set()
+            return
+
         # Check if we receive a new start beam
         if 'set_beam' not in p_msg:
             # Raise error
             raise ValueError('Missing references to a beam: ' + str(p_msg))
 
-        # Set the new value
+        # Set the new value and hand it over to the sweep thread
+        self._decision_time = clock.now()
         self.new_set_beam = p_msg.get('set_beam', {'tx': 32, 'rx': 32})
+        self.new_set_kpi = p_msg.get('kpi', None)
+        self.new_set_regret = p_msg.get('regret', None)
+        self._new_beam.set()
+
+        # The link collapsed, start a new IA procedure
+        if p_msg.get('reacquire', False):
+            self._reacquire.set()
+
+        # The selector found a pair that is good enough, stop sweeping
+        if p_msg.get('early_stop', False):
+            self.logging.info(f'Early stop of the IA procedure #{self._counter}')
+            self._abort.set()
 
 
     def set_tx_iterable(self, tx_iterable):
@@ -207,3 +674,15 @@ class beam_sweep(gr.basic_block):
         self._temp_inner_iterable = rx_iterable
         self._rx_change_iterable = True
         self.logging.info(f'Changing RX iterable to {self._temp_inner_iterable}')
+
+    def get_min_dwell(self):
+        return self._min_dwell
+
+    def get_decision_latency(self):
+        return self.decision_latency
+
+    def get_slot_lateness(self):
+        return self.slot_lateness
+
+    def get_ia_stats(self):
+        return self.ia_stats
@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2022 Virginia Tech.
+#
+# This is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this software; see the file COPYING.  If not, write to
+# the Free Software Foundation, Inc., 51 Franklin Street,
+# Boston, MA 02110-1301, USA.
+#
+
+import logging
+import numpy as np
+import pmt
+from collections import deque
+from gnuradio import gr
+from .timebase import clock, usrp_clock
+
+
+class beam_tagger(gr.sync_block):
+    """
+    Pass samples through and tag the sample where each beam change lands
+
+    Sits between the USRP source and the RSS calculation. Every beam_id
+    message becomes a 'beam_id' stream tag with the TX and RX beams and the
+    host monotonic switch time, and every trigger message a 'trigger' tag,
+    so the kpi_agg knows which samples belong to the sweep. The switch time is mapped to a sample through
+    the rx_time tags of the USRP source when the USRP time is anchored,
+    otherwise by assuming the newest sample arrived just now.
+
+    The rx_time tags anchor the USRP time to the host clock. Buffers wait in
+    the queues before work() runs, so the anchor is the one of the buffer
+    that waited least, over the last anchor periods. It goes out on the
+    'usrp_time' port whenever it changes, so the beam_mapper can time the
+    GPIO commands of a USRP that shares the same time.
+    """
+    def __init__(self, samp_rate=2e6, debug=False):
+        gr.sync_block.__init__(self,
+            name="Beam Tagger",
+            in_sig=[np.complex64],
+            out_sig=[np.complex64]
+        )
+
+        # Register message port
+        self.message_port_register_in(pmt.intern('beam_id'))
+        self.message_port_register_in(pmt.intern('trigger'))
+        self.message_port_register_out(pmt.intern('usrp_time'))
+
+        # Assign beam ID and trigger message handlers
+        self.set_msg_handler(pmt.intern('beam_id'), self.beam_id_msg_handler)
+        self.set_msg_handler(pmt.intern('trigger'), self.trigger_msg_handler)
+
+        # Set class variables
+        self._samp_rate = samp_rate
+        self._tag_key = pmt.intern('beam_id')
+        self._trigger_key = pmt.intern('trigger')
+        self._rx_time_key = pmt.intern('rx_time')
+        self._usrp_time_port = pmt.intern('usrp_time')
+        # Beam changes and triggers waiting for their sample, in order, as
+        # (host time, tag key, tag value)
+        self._pending = deque()
+        # Clock of the USRP the samples come from
+        self._usrp_clock = usrp_clock()
+        # Sample offset and USRP time of the last rx_time tag
+        self._rx_time = None
+        # Lowest host time of the rx_time sample over the current and the
+        # last anchor period, and when the current one started
+        self._anchor_period = 1.0
+        self._anchor_best = [float('inf'), float('inf')]
+        self._anchor_since = None
+
+        logging.basicConfig(
+            level=logging.DEBUG if debug else logging.INFO,
+            format='[%(levelname)s] [%(name)s] %(message)s'
+        )
+        self.logging = logging.getLogger(self.name())
+
+    def set_usrp_time(self, usrp_time, host_time=None):
+        """
+        Anchor the USRP time, in seconds, to the host monotonic clock
+        """
+        self._usrp_clock.set(usrp_time, host_time)
+
+    def get_samp_rate(self):
+        return self._samp_rate
+
+    def set_samp_rate(self, samp_rate):
+        self._samp_rate = samp_rate
+
+    def sample_offset(self, host_time, end_offset, now):
+        """
+        Absolute sample offset of an instant of the host monotonic clock
+        """
+        # Go through the USRP clock if we can
+        if self._usrp_clock.anchored and self._rx_time is not None:
+            usrp_time = self._usrp_clock.usrp_time(host_time)
+            return int(round(
+                self._rx_time[0] + (usrp_time - self._rx_time[1]) * self._samp_rate
+            ))
+
+        # Otherwise, the last sample of the buffer just arrived
+        return int(round(end_offset + (host_time - now) * self._samp_rate))
+
+    def reference(self, offset, usrp_time, now):
+        """
+        Start a new USRP time reference, the anchors of the last one are void
+        """
+        self._rx_time = (offset, usrp_time)
+        self._anchor_best = [float('inf'), float('inf')]
+        self._anchor_since = now
+
+    def anchor(self, end, now):
+        """
+        Anchor the USRP time with the buffer that waited least in the queues
+
+        The newest sample arrived just now at the latest, so every buffer
+        bounds the host time of the rx_time sample. Keeping the lowest bound
+        of the last two anchor periods follows the drift between the clocks.
+        """
+        host_time = now - (end - self._rx_time[0]) / self._samp_rate
+
+        # Start a new period, the last one is only kept for one more
+        if now - self._anchor_since > self._anchor_period:
+            self._anchor_best = [host_time, self._anchor_best[0]]
+            self._anchor_since = now
+        else:
+            self._anchor_best[0] = min(self._anchor_best[0], host_time)
+
+        host_time = min(self._anchor_best)
+        if self._usrp_clock.anchor == (self._rx_time[1], host_time):
+            return
+
+        self.set_usrp_time(self._rx_time[1], host_time)
+        self.message_port_pub(self._usrp_time_port, pmt.to_pmt(
+            {'usrp_time': self._rx_time[1], 'time': host_time}
+        ))
+
+    def work(self, input_items, output_items):
+        num_items = len(output_items[0])
+        output_items[0][:] = input_items[0][:num_items]
+
+        start = self.nitems_written(0)
+        end = start + num_items
+        now = clock.now()
+
+        # Keep the latest USRP time reference
+        for tag in self.get_tags_in_window(0, 0, num_items, self._rx_time_key):
+            full_secs, frac_secs = pmt.to_python(tag.value)
+            self.reference(tag.offset, full_secs + frac_secs, now)
+
+        # Every buffer may tell a better anchor
+        if self._rx_time is not None:
+            self.anchor(end, now)
+
+        # Tag the beam changes and triggers that land in this buffer
+        while self._pending:
+            host_time, key, value = self._pending[0]
+            offset = self.sample_offset(host_time, end, now)
+
+            # Wait for the buffer that holds it
+            if offset >= end:
+                break
+
+            self._pending.popleft()
+            # Changes we were too slow for go on the first sample we have
+            offset = max(offset, start)
+
+            self.add_item_tag(0, offset, key, pmt.to_pmt(value))
+            self.logging.debug(f'Tagged {value} at {offset}')
+
+        return num_items
+
+    def beam_id_msg_handler(self, msg):
+        # Convert message to python
+        p_msg = pmt.to_python(msg)
+        # Print debug information
+        self.logging.debug(f'Received Beam ID message: {p_msg}')
+
+        # If we have no references to TX or RX
+        if 'tx' not in p_msg or 'rx' not in p_msg:
+            # Raise error
+            raise ValueError('Missing references to any antenna: ' + str(p_msg))
+
+        # Without a scheduled instant, the beam changes right away
+        host_time = p_msg.get('time', clock.now())
+        self._pending.append((
+            host_time, self._tag_key,
+            {'tx': p_msg['tx'], 'rx': p_msg['rx'], 'time': host_time}
+        ))
+
+    def trigger_msg_handler(self, msg):
+        # Convert message to python
+        p_msg = pmt.to_python(msg)
+        # Print debug information
+        self.logging.debug(f'Received trigger message: {p_msg}')
+
+        # Check if we receive a new sweep state
+        if 'trigger' not in p_msg:
+            raise ValueError('Missing trigger references: ' + str(p_msg))
+
+        # The sweep starts or ends now
+        host_time = clock.now()
+        self._pending.append(
+            (host_time, self._trigger_key, dict(p_msg, time=host_time))
+        )
@@ -0,0 +1,450 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2022 Virginia Tech.
+#
+# This is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this software; see the file COPYING.  If not, write to
+# the Free Software Foundation, Inc., 51 Franklin Street,
+# Boston, MA 02110-1301, USA.
+#
+
+"""
+Buffered binary logs written off the hot path
+
+The blocks push fixed-size records into a queue and a single writer thread,
+shared by every open log, stores them in chunks, column by column. A log file starts with a magic
+string, the length of a JSON header and the header itself, which lists the
+fields and pairs the monotonic and wall clocks. Every chunk is the number
+of records followed by the bytes of each column, in the header order. The
+first column is always the host monotonic time of the record, in ns.
+
+For long runs, ring_log keeps the records of a bounded log in a
+memory-mapped file instead. The JSON header is followed, 64-byte aligned,
+by the number of records written so far, the number of records being
+written and the ring of records, so ring_reader can follow a log while it
+is written and tell which records were overwritten while it read them.
+"""
+
+import csv
+import json
+import logging
+import struct
+import numpy as np
+from queue import SimpleQueue, Empty
+from threading import Event, Thread, Lock
+from time import monotonic_ns
+from .timebase import clock, timebase
+
+MAGIC = b'STAMLOG1'
+RING_MAGIC = b'STAMRING'
+
+
+def _record_dtype(fields):
+    # Every record starts with its monotonic timestamp
+    return np.dtype([('time_ns', np.int64)] + [
+        (str(name), np.dtype(kind)) for name, kind in fields
+    ])
+
+
+def _header(magic, dtype, **extra):
+    header = json.dumps(dict(
+        fields=[[name, dtype[name].str] for name in dtype.names],
+        # Pair of clocks of the shared time base, to recover wall time
+        **clock.anchor(),
+        **extra
+    )).encode()
+
+    return magic + struct.pack('<I', len(header)) + header
+
+
+def open_log(path, fields, ring_size=0):
+    """
+    A ring_log of `ring_size` records if given, otherwise a binary_log
+    """
+    if ring_size:
+        return ring_log(path, fields, ring_size)
+
+    return binary_log(path, fields)
+
+
+class _log_writer(object):
+    """
+    Writer thread shared by every open binary_log
+
+    The thread starts with the first log and is joined when the last one is
+    closed. Each run of the thread drains its own queue, so a log opened
+    while the previous thread stops never loses records to it.
+    """
+    def __init__(self):
+        self._lock = Lock()
+        self._logs = 0
+        self._queue = None
+        self._thread = None
+
+    def open(self):
+        with self._lock:
+            self._logs += 1
+
+            if self._thread is None:
+                self._queue = SimpleQueue()
+                self._thread = Thread(
+                    target=self._run, args=(self._queue,),
+                    name='stamina-log-writer', daemon=True
+                )
+                self._thread.start()
+
+    def put(self, log, row):
+        self._queue.put((log, row))
+
+    def close(self, log):
+        # Wait for the records of the log to be written
+        done = Event()
+        self._queue.put((log, done))
+        done.wait()
+
+        with self._lock:
+            self._logs -= 1
+            if self._logs:
+                return
+
+            thread, self._thread = self._thread, None
+            # No log left, stop the thread
+            self._queue.put((None, None))
+
+        thread.join()
+
+    @staticmethod
+    def _run(queue):
+        # Records not written yet, and when they are due, for every log
+        rows = {}
+        deadlines = {}
+
+        while True:
+            timeout = None if not deadlines else \
+                max(min(deadlines.values()) - monotonic_ns(), 0) / 1e9
+
+            try:
+                log, row = queue.get(timeout=timeout)
+            except Empty:
+                log, row = None, ()
+
+            if log is None and row is None:
+                return
+
+            # Batches go out in their own chunk, closing flushes the log
+            if isinstance(row, (np.ndarray, Event)):
+                log._write_chunk(rows.pop(log, []))
+                deadlines.pop(log, None)
+
+                if isinstance(row, Event):
+                    row.set()
+                else:
+                    log._write_chunk(row)
+
+            elif log is not None:
+                pending = rows.setdefault(log, [])
+                if not pending:
+                    deadlines[log] = monotonic_ns() + int(log._flush_period * 1e9)
+                pending.append(row)
+
+                # Write a chunk when full
+                if len(pending) >= log._chunk:
+                    log._write_chunk(rows.pop(log))
+                    del deadlines[log]
+
+            # Or when it is time
+            now = monotonic_ns()
+            for log in [log for log, deadline in deadlines.items() if deadline <= now]:
+                log._write_chunk(rows.pop(log))
+                del deadlines[log]
+
+
+# Started on first use
+_writer = _log_writer()
+
+
+class binary_log(object):
+    """
+    Log of records with a fixed set of fields, written by the shared thread
+    """
+    def __init__(self, path, fields, chunk=4096, flush_period=0.5):
+        self.dtype = _record_dtype(fields)
+        self._chunk = chunk
+        self._flush_period = flush_period
+        self._closed = False
+
+        self._file = open(path, 'wb')
+        self._file.write(_header(MAGIC, self.dtype))
+        self.logging = logging.getLogger(path)
+
+        _writer.open()
+
+    def write(self, *values):
+        """
+        Queue a record, with the values in the order of the fields
+        """
+        if not self._closed:
+            _writer.put(self, (clock.now_ns(),) + values)
+
+    def write_batch(self, *columns):
+        """
+        Queue many records at once, given as one sequence per field
+        """
+        if self._closed:
+            return
+
+        records = np.empty(len(columns[0]), dtype=self.dtype)
+        records['time_ns'] = clock.now_ns()
+        for name, column in zip(self.dtype.names[1:], columns):
+            records[name] = column
+
+        _writer.put(self, records)
+
+    def close(self):
+        """
+        Write what is left in the queue and close the file
+        """
+        if self._closed:
+            return
+
+        self._closed = True
+        _writer.close(self)
+        self._file.close()
+
+    def _write_chunk(self, rows):
+        if not len(rows):
+            return
+
+        # Keep the writer alive whatever the blocks queue
+        try:
+            records = self._records(rows)
+            self._file.write(struct.pack('<I', len(records)))
+            for name in self.dtype.names:
+                self._file.write(records[name].tobytes())
+            self._file.flush()
+
+        except Exception:
+            self.logging.exception(f'Dropped a chunk of {len(rows)} records')
+
+    def _records(self, rows):
+        """
+        Structured array of the queued records, without the invalid ones
+        """
+        if isinstance(rows, np.ndarray):
+            return rows
+
+        try:
+            return np.asarray(rows, dtype=self.dtype)
+
+        except (TypeError, ValueError):
+            pass
+
+        # Convert one record at a time, to keep the good ones
+        records = []
+        for row in rows:
+            try:
+                records.append(np.asarray(row, dtype=self.dtype))
+            except (TypeError, ValueError) as error:
+                self.logging.error(f'Dropped record {row}: {error}')
+
+        return np.array(records, dtype=self.dtype)
+
+
+class ring_log(object):
+    """
+    Bounded log of records in a memory-mapped ring, overwriting the oldest
+    """
+    def __init__(self, path, fields, size):
+        # Check whether the ring makes sense
+        if size < 1:
+            raise ValueError('Invalid ring size: ' + str(size))
+
+        self.dtype = _record_dtype(fields)
+        self.size = size
+
+        header = _header(RING_MAGIC, self.dtype, size=size)
+        index_offset = -(-len(header) // 64) * 64
+
+        # Lay out the file, then map the write index and the records
+        with open(path, 'wb') as ring_file:
+            ring_file.write(header)
+            ring_file.truncate(index_offset + 64 + size * self.dtype.itemsize)
+
+        # Records written, then records being written
+        self._index = np.memmap(
+            path, dtype=np.uint64, mode='r+', offset=index_offset, shape=(2,)
+        )
+        self._records = np.memmap(
+            path, dtype=self.dtype, mode='r+', offset=index_offset + 64,
+            shape=(size,)
+        )
+        self._count = 0
+        self._closed = False
+        self._lock = Lock()
+
+    def write(self, *values):
+        """
+        Store a record, with the values in the order of the fields
+        """
+        with self._lock:
+            # Records that come after closing are dropped
+            if self._closed:
+                return
+
+            # Claim the slot before overwriting it
+            self._index[1] = self._count + 1
+            self._records[self._count % self.size] = (clock.now_ns(),) + values
+            self._count += 1
+            # Publish the record only once it is complete
+            self._index[0] = self._count
+
+    def write_batch(self, *columns):
+        """
+        Store many records at once, given as one sequence per field
+        """
+        now = clock.now_ns()
+        length = len(columns[0])
+
+        # Only the last records of a batch larger than the ring would stay
+        skip = max(length - self.size, 0)
+
+        with self._lock:
+            if self._closed:
+                return
+
+            self._index[1] = self._count + length
+            slots = (self._count + np.arange(skip, length)) % self.size
+            self._records['time_ns'][slots] = now
+            for name, column in zip(self.dtype.names[1:], columns):
+                self._records[name][slots] = np.asarray(column)[skip:]
+            self._count += length
+            self._index[0] = self._count
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+
+            self._closed = True
+            self._records.flush()
+            self._index.flush()
+
+
+class ring_reader(object):
+    """
+    Read-only view of a ring_log, also while it is written
+    """
+    def __init__(self, path):
+        with open(path, 'rb') as ring_file:
+            self.header = read_header(ring_file, RING_MAGIC)
+            index_offset = -(-ring_file.tell() // 64) * 64
+
+        self.dtype = np.dtype([(name, kind) for name, kind in self.header['fields']])
+        self.size = self.header['size']
+
+        self._index = np.memmap(
+            path, dtype=np.uint64, mode='r', offset=index_offset, shape=(2,)
+        )
+        # The ring itself, without copies, in storage order
+        self.records = np.memmap(
+            path, dtype=self.dtype, mode='r', offset=index_offset + 64,
+            shape=(self.size,)
+        )
+
+    @property
+    def count(self):
+        """
+        Number of records written since the log was created
+        """
+        return int(self._index[0])
+
+    def latest(self, number=None):
+        """
+        Copy of the last records, oldest first
+
+        Records the writer overwrote while they were copied are left out, so
+        fewer records than asked may come back from a busy ring.
+        """
+        count = self.count
+        number = min(count, self.size if number is None else number)
+        first = count - number
+        records = self.records[np.arange(first, count) % self.size]
+
+        # Records whose slots were claimed by the writer in the meantime
+        claimed = int(self._index[1])
+        return records[min(max(claimed - self.size - first, 0), number):]
+
+
+def read_header(log_file, magic=MAGIC):
+    if log_file.read(len(magic)) != magic:
+        raise ValueError('Not a STAMINA binary log')
+
+    length, = struct.unpack('<I', log_file.read(4))
+    return json.loads(log_file.read(length))
+
+
+def read(path):
+    """
+    Load a binary log as a structured array, and its header
+    """
+    with open(path, 'rb') as log_file:
+        # Rings hold their records in place
+        if log_file.read(len(RING_MAGIC)) == RING_MAGIC:
+            reader = ring_reader(path)
+            return reader.latest(), reader.header
+
+        log_file.seek(0)
+        header = read_header(log_file)
+        dtype = np.dtype([(name, kind) for name, kind in header['fields']])
+
+        chunks = []
+        while True:
+            size = log_file.read(4)
+            if len(size) < 4:
+                break
+
+            count, = struct.unpack('<I', size)
+            data = log_file.read(count * dtype.itemsize)
+            # A partial chunk means the writer was interrupted
+            if len(data) < count * dtype.itemsize:
+                break
+
+            # Split the chunk into its columns
+            records = np.empty(count, dtype=dtype)
+            offset = 0
+            for name in dtype.names:
+                width = count * dtype[name].itemsize
+                records[name] = np.frombuffer(
+                    data, dtype=dtype[name], count=count, offset=offset
+                )
+                offset += width
+            chunks.append(records)
+
+    return np.concatenate(chunks) if chunks else np.empty(0, dtype), header
+
+
+def to_csv(path, csv_path):
+    """
+    Convert a binary log to CSV, adding the UTC date and time of each record
+    """
+    records, header = read(path)
+
+    # Time base of the log, from the pair of clocks of the header
+    log_clock = timebase(header['monotonic_ns'], header['time_ns'])
+
+    with open(csv_path, 'w', newline='') as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(('wall_time',) + records.dtype.names)
+        for record in records.tolist():
+            writer.writerow((log_clock.format(record[0]),) + record)
@@ -23,12 +23,15 @@ import logging
 import numpy
 import pmt
 from copy import copy
+from collections import deque
 from gnuradio import gr
-from time import sleep
+from math import exp
 import numpy as np
 
-from datetime import datetime
-from threading import Thread, Lock, Event
+from threading import Thread, Lock, Event, Condition
+
+from .binary_log import open_log
+from .timebase import clock
 
 
 class kpi_agg(gr.sync_block):
@@ -42,9 +45,35 @@ class kpi_agg(gr.sync_block):
         standalone=False,
         meas_period=300e-6,
         sensitivity=-90.0,
-        debug=False
+        debug=False,
+        monitor=False,
+        drop_margin=6.0,
+        trend=0.0,
+        monitor_tau=0.1,
+        calibrate=False,
+        settle_tolerance=1.0,
+        discard=0.0,
+        use_tags=False,
+        per_dwell=False,
+        hist_edges=None,
+        batch=None,
+        ring_size=0,
+        samp_rate=0.0
     ):
 
+        # Check whether we know how to batch the KPIs
+        if batch not in (None, 'dwell', 'sweep'):
+            raise ValueError('Invalid KPI batch: ' + str(batch))
+
+        # Tagged runs can be shorter than the measurement period, only dwell
+        # summaries keep every one of them
+        if use_tags and not per_dwell:
+            raise ValueError('Beams from tags need one KPI per dwell')
+
+        # The settling times are counted in samples of the RSS stream
+        if calibrate and samp_rate <= 0:
+            raise ValueError('Calibration needs the RSS sample rate: ' + str(samp_rate))
+
         gr.sync_block.__init__(self,name='KPI Aggregator',
                                in_sig=[numpy.float32],
                                out_sig=None)
@@ -53,6 +82,7 @@ class kpi_agg(gr.sync_block):
         self.message_port_register_in(pmt.intern('beam_id'))
         self.message_port_register_in(pmt.intern('trigger'))
         self.message_port_register_out(pmt.intern('kpi_out'))
+        self.message_port_register_out(pmt.intern('sweep'))
 
         # Assign beam ID message handler
         self.set_msg_handler(pmt.intern('beam_id'), self.beam_id_msg_handler)
@@ -60,9 +90,55 @@ class kpi_agg(gr.sync_block):
 
         # Set class variables
         self._meas_period = meas_period
+        # Split the input by the beam_id tags instead of the beam_id messages
+        self._use_tags = use_tags
+        self._tag_key = pmt.intern('beam_id')
+        # With tags, the end of a sweep waits for its trigger tag, so the
+        # samples of the last dwell still in flight are kept, or for this
+        # long if the tag never comes
+        self._trigger_key = pmt.intern('trigger')
+        self._pending_trigger = None
+        self._pending_since = None
+        self._trigger_tag_seen = False
+        self._tag_timeout = 1.0
+        # Send one summary per dwell instead of a KPI every period
+        self._per_dwell = per_dwell
+        # Optional bin edges of an RSS histogram of every dwell
+        self._hist_edges = None if hist_edges is None else np.asarray(hist_edges)
+        # Beam pair, statistics and planned end of the dwell being summarized
+        self._dwell_beam = None
+        self._dwell_stats = None
+        self._dwell_end = None
+        # Send the KPIs of every dwell or sweep in a single message
+        self._batch = batch
+        self._batch_kpis = []
         self._sensitivity = sensitivity
         self._trigger = standalone
 
+        # Monitor the serving pair between IAs and ask for one if it drops
+        self._monitor = monitor
+        self._drop_margin = drop_margin
+        # Slope, in dB per second, that also calls for a new IA
+        self._trend = trend
+        self._monitor_tau = monitor_tau
+        # Whether the last IA procedure is over and we are sending data
+        self._data_mode = False
+        self._reset_monitor()
+
+        # Skip the KPIs this long after a beam change, while the RSS settles
+        self._discard = discard
+        self._settle_until = 0.0
+        # Measure the settling time of every dwell of the IA procedures
+        self._calibrate = calibrate
+        self._settle_tolerance = settle_tolerance
+        # RSS trace of the current dwell, as (time since the change, RSS)
+        # blocks, timed by the samples since the one the beam changed at
+        self._samp_rate = samp_rate
+        self._trace = []
+        self._trace_start = None
+        # Settling times of the last dwells
+        self._settle_times = deque(maxlen=1024)
+
         logging.basicConfig(
             level=logging.DEBUG if debug else logging.INFO,
             format='[%(levelname)s] [%(name)s] %(message)s'
@@ -81,12 +157,18 @@ class kpi_agg(gr.sync_block):
         self._beam_change = Event()
         # Create lock to enforce atomic operations
         self._lock = Lock()
-
-        # Create files to save log information
-        self.beam_log = open(beam_file, "w")
-        self.beam_log.write("measurement,TX,RX\n")
-        self.meas_log = open(meas_file, "w")
-        self.meas_log.write("measurement,TX,RX,KPI\n")
+        # Create condition to wake up the thread when triggered
+        self._wakeup = Condition()
+        # Beam changes scheduled for a later instant, in order
+        self._pending_beams = deque()
+
+        # Create files to save log information, bounded rings if sized
+        self.beam_log = open_log(
+            beam_file, (('tx', 'u1'), ('rx', 'u1')), ring_size
+        )
+        self.meas_log = open_log(
+            meas_file, (('tx', 'u1'), ('rx', 'u1'), ('kpi', 'f4')), ring_size
+        )
 
     def start(self):
         """
@@ -101,8 +183,10 @@ class kpi_agg(gr.sync_block):
         """
         Called at the end of the flowgraph execution to free resources
         """
-        # Toggle flag to stop thread and join it
+        # Toggle flag to stop thread, wake it up and join it
         self._finished.set()
+        with self._wakeup:
+            self._wakeup.notify_all()
         self._thread.join()
 
         # Close files we left open
@@ -112,19 +196,285 @@ class kpi_agg(gr.sync_block):
         return gr.sync_block.stop(self)
 
     def work(self, input_items, output_items):
+        # Let the tags tell which beam pair each sample belongs to
+        if self._use_tags:
+            return self.work_tagged(input_items[0])
+
         # If triggered and set to work
         if self._trigger and self.tx_beam_index and self.rx_beam_index:
-            # Get the most recent sample
-            measurement = np.mean(input_items[0])
+            # Fold the whole buffer into the statistics of the dwell
+            if self._per_dwell:
+                self.accumulate(input_items[0])
 
-            # Check whether the measurement is above sensitivity
-            if  float(measurement) > self._sensitivity:
-                # With the lock
-                with self._lock:
-                   self.measurement = measurement
+            else:
+                # Get the most recent sample
+                measurement = np.mean(input_items[0])
+
+                # Check whether the measurement is above sensitivity
+                if  float(measurement) > self._sensitivity:
+                    # With the lock
+                    with self._lock:
+                       self.measurement = measurement
+
+            # Follow the RSS since the last beam change
+            if self._calibrate:
+                self.trace(input_items[0], self.nitems_read(0))
+
+        # Otherwise, keep an eye on the serving pair
+        elif self._monitor and self._data_mode and self.tx_beam_index:
+            self.monitor(float(np.mean(input_items[0])))
 
         return len(input_items[0])
 
+    def work_tagged(self, samples):
+        """
+        Measure each run of samples between beam_id tags with its own pair
+
+        The trigger tag that marks the end of a sweep closes its last dwell.
+        """
+        start = self.nitems_read(0)
+        tags = sorted(
+            self.get_tags_in_window(0, 0, len(samples), self._tag_key) +
+            self.get_tags_in_window(0, 0, len(samples), self._trigger_key),
+            key=lambda tag: tag.offset
+        )
+
+        # Boundaries of the runs of samples of a single beam pair
+        bounds = [0] + [tag.offset - start for tag in tags] + [len(samples)]
+
+        for index, (first, last) in enumerate(zip(bounds[:-1], bounds[1:])):
+            if index:
+                tag = tags[index - 1]
+                value = pmt.to_python(tag.value)
+
+                # The stream reached the end of the sweep
+                if pmt.eq(tag.key, self._trigger_key):
+                    if not value.get('trigger', True):
+                        self.end_of_sweep()
+
+                # The tag marks the exact sample, no need to skip any KPIs
+                else:
+                    self.set_beam(
+                        value['tx'], value['rx'], settle=False, offset=tag.offset
+                    )
+
+            if last == first or not self.tx_beam_index:
+                continue
+
+            # Fold the run into the statistics of the dwell
+            if self._trigger:
+                self.accumulate(samples[first:last])
+
+                # Follow the RSS since the beam change
+                if self._calibrate:
+                    self.trace(samples[first:last], start + first)
+
+            # Otherwise, keep an eye on the serving pair
+            elif self._monitor and self._data_mode:
+                self.monitor(float(np.mean(samples[first:last])))
+
+        return len(samples)
+
+    def end_of_sweep(self):
+        """
+        Apply the end of the sweep held until the stream got there
+        """
+        with self._lock:
+            p_msg, self._pending_trigger = self._pending_trigger, None
+            # The tag came before the message, which can then apply at once
+            self._trigger_tag_seen = p_msg is None
+
+        if p_msg is not None:
+            self.set_trigger(p_msg)
+
+        # Or close the last dwell, the samples after the tag are not ours
+        else:
+            self.flush()
+
+    def trace(self, samples, offset):
+        """
+        Add a block of RSS samples to the trace of the current dwell
+
+        Without a tag, the beam changed at the first sample we see after it.
+        """
+        with self._lock:
+            if self._trace_start is None:
+                self._trace_start = offset
+
+            # Time of every sample since the change, from the sample offsets
+            times = (offset - self._trace_start + np.arange(len(samples))) / self._samp_rate
+            self._trace.append(np.column_stack((times, samples)))
+
+    def accumulate(self, samples):
+        """
+        Add a block of RSS samples to the statistics of the current dwell
+
+        Only the work thread updates the statistics, so there is no lock
+        here: open_dwell and flush swap the whole dwell under the lock, and
+        each buffer replaces the moments of the dwell in a single assignment.
+        """
+        stats = self._dwell_stats
+
+        # No open dwell, no samples, or the RSS is still settling
+        if stats is None or not len(samples) or clock.now() < self._settle_until:
+            return
+
+        # Moments of the buffer, in double precision
+        samples = np.asarray(samples, dtype=np.float64)
+        count_b = len(samples)
+        mean_b = float(samples.mean())
+        centered = samples - mean_b
+        m2_b = float(np.dot(centered, centered))
+
+        # Merge them with the moments of the dwell, as in Chan's method
+        count_a, mean_a, m2_a, low, high, hist = stats['moments']
+        count = count_a + count_b
+        delta = mean_b - mean_a
+
+        if self._hist_edges is not None:
+            hist = hist + np.histogram(samples, self._hist_edges)[0].astype(np.uint32)
+
+        stats['moments'] = (
+            count,
+            mean_a + delta * count_b / count,
+            m2_a + m2_b + delta ** 2 * count_a * count_b / count,
+            min(low, float(samples.min())),
+            max(high, float(samples.max())),
+            hist
+        )
+
+    def open_dwell(self, tx_beam, rx_beam, dwell=None):
+        """
+        Start the statistics of a new dwell, call with the lock
+        """
+        self._dwell_beam = (tx_beam, rx_beam)
+        # Count, mean, sum of squared differences, min, max and histogram
+        self._dwell_stats = {'moments': (
+            0, 0.0, 0.0, float('inf'), float('-inf'),
+            None if self._hist_edges is None else
+                np.zeros(len(self._hist_edges) - 1, dtype=np.uint32)
+        )}
+        self._dwell_end = None if dwell is None else clock.now() + dwell
+
+    def flush(self):
+        """
+        Close the current dwell and send its summary
+        """
+        with self._lock:
+            beam, stats = self._dwell_beam, self._dwell_stats
+            self._dwell_beam = None
+            self._dwell_stats = None
+            self._dwell_end = None
+
+        if beam is None:
+            return
+
+        count, mean, m2, low, high, hist = stats['moments']
+        if not count:
+            return
+
+        # Check whether the dwell is above sensitivity
+        if mean <= self._sensitivity:
+            return
+
+        summary = {
+            "val": mean,
+            "tx": beam[0],
+            "rx": beam[1],
+            "count": count,
+            "std": float(np.sqrt(m2 / count)),
+            "min": low,
+            "max": high
+        }
+        if hist is not None:
+            summary["hist"] = hist
+
+        self.emit(summary)
+
+        self.meas_log.write(summary['tx'], summary['rx'], summary['val'])
+
+    def emit(self, kpi_dict):
+        """
+        Send a KPI right away, or keep it for the next batch
+        """
+        if self._batch is None:
+            self.message_port_pub(pmt.intern('kpi_out'), pmt.to_pmt(kpi_dict))
+            return
+
+        with self._lock:
+            self._batch_kpis.append(
+                (kpi_dict['val'], kpi_dict['tx'], kpi_dict['rx'])
+            )
+
+    def flush_batch(self, end=False, opening=False):
+        """
+        Send the KPIs kept so far as uniform vectors, in one message
+
+        The last batch of a sweep is flagged with 'end'. It is sent even if
+        empty, as is the opening batch that tells the selector to wait for it.
+        """
+        with self._lock:
+            kpis, self._batch_kpis = self._batch_kpis, []
+
+        if not kpis and not end and not opening:
+            return
+
+        kpi, tx_beam, rx_beam = zip(*kpis) if kpis else ((), (), ())
+
+        self.message_port_pub(
+            pmt.intern('kpi_out'),
+            pmt.to_pmt({
+                "val": np.array(kpi, dtype=np.float32),
+                "tx": np.array(tx_beam, dtype=np.uint8),
+                "rx": np.array(rx_beam, dtype=np.uint8),
+                "end": end
+            })
+        )
+
+    def _reset_monitor(self):
+        # Smoothed RSS, its peak since the last IA and its slope
+        self._level = None
+        self._reference = None
+        self._slope = 0.0
+        self._level_time = None
+        self._ia_requested = False
+
+    def monitor(self, rss):
+        """
+        Track the RSS of the serving pair and ask for an IA when it drops
+        """
+        now = clock.now()
+
+        if self._level is None:
+            self._level = self._reference = rss
+            self._level_time = now
+            return
+
+        # Exponential smoothing with a time constant, whatever the buffer size
+        dt = now - self._level_time
+        self._level_time = now
+        alpha = 1.0 - exp(-dt / self._monitor_tau)
+
+        previous = self._level
+        self._level += alpha * (rss - self._level)
+        if dt > 0:
+            self._slope += alpha * ((self._level - previous) / dt - self._slope)
+
+        # The best level since the IA is our reference
+        self._reference = max(self._reference, self._level)
+
+        if self._ia_requested:
+            return
+
+        if self._reference - self._level > self._drop_margin or \
+                (self._trend and self._slope < -self._trend):
+            self._ia_requested = True
+            self.logging.info(
+                f'RSS dropped from {self._reference} to {self._level} ' + \
+                f'({self._slope} dB/s), requesting IA'
+            )
+            self.message_port_pub(pmt.intern('sweep'), pmt.to_pmt({'reacquire': True}))
+
     def measure(self):
         """
         Periodically collected measurements
@@ -134,44 +484,73 @@ class kpi_agg(gr.sync_block):
 
         # While our thread is going on
         while not self._finished.is_set():
-            # If not trigger, keep waiting
-            if not self._trigger:
-                sleep(1e-9)
+            # If not trigger, sleep until the trigger handler wakes us up
+            with self._wakeup:
+                while not self._trigger and not self._finished.is_set():
+                    self._wakeup.wait()
+
+            # Anchor the reporting grid at the start of the IA
+            deadline = clock.now()
 
             # Or else, let's go!
-            else:
+            while self._trigger and not self._finished.is_set():
+                # The end of the sweep never showed up in the stream
+                if self._pending_trigger is not None and \
+                        clock.now() - self._pending_since > self._tag_timeout:
+                    self.logging.warning('No trigger tag, ending the sweep')
+                    self.end_of_sweep()
+                    break
+
+                # Apply the scheduled beam changes that are due
+                while self._pending_beams and \
+                        self._pending_beams[0][0] <= clock.now():
+                    _, tx_beam, rx_beam, dwell = self._pending_beams.popleft()
+                    self.set_beam(tx_beam, rx_beam, dwell=dwell)
+
+                # Close the dwell just before it ends, ahead of the trigger
+                if self._per_dwell:
+                    if self._dwell_end is not None and \
+                            clock.now() >= self._dwell_end - self._meas_period:
+                        self.flush()
+
                 # If there was a recent beam change, skip measurements
-                if self._beam_change.is_set():
-                    # Clear the flag and move on
-                    self._beam_change.clear()
+                elif self._beam_change.is_set():
+                    # Clear the flag once the RSS had time to settle
+                    if clock.now() >= self._settle_until:
+                        self._beam_change.clear()
 
                 # If there is no change, report measurements
                 elif self.tx_beam_index and self.rx_beam_index:
                     # With the lock, get a copy of the values we need
                     with self._lock:
-                        # Update measurement dict
-                        measurement_dict = {
+                        # Update measurement dict, unless the pair has no KPI yet
+                        measurement_dict = None if self.measurement is None else {
                             "val": float(copy(self.measurement)),
                             "tx": copy(self.tx_beam_index),
                             "rx": copy(self.rx_beam_index)
                         }
 
-                    # Convert GPIO dict to PMT and sent control port message
-                    self.message_port_pub(
-                        pmt.intern('kpi_out'),
-                        pmt.to_pmt(measurement_dict)
-                    )
+                    if measurement_dict is not None:
+                        # Convert GPIO dict to PMT and sent control port message
+                        self.emit(measurement_dict)
 
-                    # We need the lock to prevent variable change before writing
-                    self.meas_log.write(
-                        f"{datetime.now().strftime('%H:%M:%S.%f')}," + \
-                        f"{measurement_dict['tx']},{measurement_dict['rx']}," \
-                        f"{measurement_dict['val']}\n"
-                    )
+                        # Hand the record over to the writer thread
+                        self.meas_log.write(
+                            measurement_dict['tx'], measurement_dict['rx'],
+                            measurement_dict['val']
+                        )
 
+                # Move to the next point of the measurement grid
+                deadline += self._meas_period
+                now = clock.now()
+
+                # If we are running late, skip the slots we missed
+                if deadline <= now:
+                    deadline += \
+                        ((now - deadline) // self._meas_period + 1) * self._meas_period
 
                 # Wait for the next measurement period
-                sleep(self._meas_period)
+                self._finished.wait(deadline - now)
 
     def trigger_msg_handler(self, msg):
         # Convert message to python
@@ -184,9 +563,108 @@ class kpi_agg(gr.sync_block):
             # Raise error
             raise ValueError('Missing trigger references: ' + str(p_msg))
 
-        # Set the new value
-        self._trigger = p_msg.get('trigger', True)
+        if self._use_tags:
+            # A new sweep, finish the previous one if its tag never came
+            if p_msg['trigger']:
+                if self._pending_trigger is not None:
+                    self.end_of_sweep()
+                self._trigger_tag_seen = False
+
+            # Hold the end of the sweep until the stream gets there
+            else:
+                with self._lock:
+                    hold = not self._trigger_tag_seen
+                    self._trigger_tag_seen = False
+                    if hold:
+                        self._pending_trigger = p_msg
+                        self._pending_since = clock.now()
+
+                if hold:
+                    return
+
+        self.set_trigger(p_msg)
+
+    def set_trigger(self, p_msg):
+        """
+        Start or end a sweep
+        """
+        # The sweep stopped, summarize the last dwell
+        if self._per_dwell and not p_msg.get('trigger', True):
+            self.flush()
+
+        # And send what is left of the batch
+        if self._batch and not p_msg.get('trigger', True):
+            self.flush_batch(end=True)
+
+        # Or drop what was left over from the previous sweep, and tell the
+        # selector to hold its decision until the last batch of this one
+        elif self._batch:
+            with self._lock:
+                self._batch_kpis = []
+            self.flush_batch(opening=True)
+
+        # Set the new value and wake up the measurement thread
+        with self._wakeup:
+            self._trigger = p_msg.get('trigger', True)
+            self._wakeup.notify_all()
+
+        # Start monitoring the new pair once the IA procedure is over, but
+        # keep the reference and the calibration across tracking rounds
+        self._data_mode = not self._trigger and p_msg.get('final', True)
+        if self._data_mode and not p_msg.get('tracking', False):
+            self._reset_monitor()
+
+            # Update the discard window with the dwells of this IA
+            if self._calibrate:
+                self.calibrate()
+
+    @staticmethod
+    def settling_time(trace, tolerance):
+        """
+        Time the RSS of a dwell took to stay within tolerance of its final level
+
+        The final level is the median of the second half of the trace. Returns
+        None if the trace is too short or never settled.
+        """
+        if len(trace) < 4:
+            return None
+
+        times, levels = np.asarray(trace, dtype=np.float64).T
+        final = np.median(levels[len(levels) // 2:])
+
+        # Last sample away from the final level
+        outside = np.flatnonzero(np.abs(levels - final) > tolerance)
+
+        if not len(outside):
+            return 0.0
+
+        if outside[-1] == len(levels) - 1:
+            return None
+
+        return float(times[outside[-1] + 1])
+
+    def calibrate(self):
+        """
+        Set the discard window from the settling times, and share the dwell
+        """
+        if not self._settle_times:
+            return
+
+        # Cover most dwells, not the single worst one
+        self._discard = float(np.quantile(self._settle_times, 0.9))
+        # Leave room for at least one KPI after the discard window
+        min_dwell = self._discard + self._meas_period
 
+        self.logging.info(
+            f'RSS settles in {self._discard:.6f}s over ' + \
+            f'{len(self._settle_times)} dwells, minimum dwell {min_dwell:.6f}s'
+        )
+        self.message_port_pub(
+            pmt.intern('sweep'), pmt.to_pmt({'min_dwell': min_dwell})
+        )
+
+    def get_discard(self):
+        return self._discard
 
     def beam_id_msg_handler(self, msg):
         # Convert message to python
@@ -194,24 +672,66 @@ class kpi_agg(gr.sync_block):
         # Print debug information
         self.logging.debug(f'Received Beam ID message: {p_msg}')
 
-        # If triggered to work
-        if self._trigger:
+        # If triggered to work, unless the tags carry the beam changes
+        if self._trigger and not self._use_tags:
             # If we have no references to TX or RX
             if 'tx' not in p_msg or 'rx' not in p_msg:
                 # Raise error
                 raise ValueError('Missing references to any antenna: ' + str(p_msg))
 
-            # With the lock
-            with self._lock:
-                # Check if we receive  a beam ID for the TX
-                self.tx_beam_index = p_msg.get('tx', 32)
-                # Check if we receive  a beam ID for the RX
-                self.rx_beam_index = p_msg.get('rx', 32)
-                # Flag we had a beam change
+            # If the beam change was pre-queued, apply it when it is due
+            if p_msg.get('time', 0.0) > clock.now():
+                self._pending_beams.append((
+                    p_msg['time'], p_msg.get('tx', 32), p_msg.get('rx', 32),
+                    p_msg.get('dwell', None)
+                ))
+
+            else:
+                self.set_beam(
+                    p_msg.get('tx', 32), p_msg.get('rx', 32),
+                    dwell=p_msg.get('dwell', None)
+                )
+
+    def set_beam(self, tx_beam, rx_beam, settle=True, dwell=None, offset=None):
+        # Summarize the dwell of the previous pair
+        if self._per_dwell:
+            self.flush()
+
+        # Send the KPIs of the previous dwell
+        if self._batch == 'dwell':
+            self.flush_batch()
+
+        # With the lock
+        with self._lock:
+            # Check if we receive  a beam ID for the TX
+            self.tx_beam_index = tx_beam
+            # Check if we receive  a beam ID for the RX
+            self.rx_beam_index = rx_beam
+
+            # Flag we had a beam change
+            if settle:
                 self._beam_change.set()
+                self._settle_until = clock.now() + self._discard
 
-            # We don't need the lock to write the metrics onto a file
-            self.beam_log.write(
-                f"{datetime.now().strftime('%H:%M:%S.%f')}," + \
-                f"{self.tx_beam_index},{self.rx_beam_index}\n"
-            )
+            # Or forget the KPI of the previous pair until we measure this one
+            else:
+                self.measurement = None
+
+            # Start summarizing the new pair
+            if self._per_dwell:
+                self.open_dwell(tx_beam, rx_beam, dwell)
+
+            # Close the RSS trace of the previous dwell and start a new one
+            if self._calibrate:
+                if self._trace:
+                    settle_time = self.settling_time(
+                        np.concatenate(self._trace), self._settle_tolerance
+                    )
+                    if settle_time is not None:
+                        self._settle_times.append(settle_time)
+                self._trace = []
+                # Sample the beam changed at, if the tag told us
+                self._trace_start = offset
+
+        # We don't need the lock to write the metrics onto a file
+        self.beam_log.write(tx_beam, rx_beam)
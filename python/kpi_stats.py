@@ -0,0 +1,392 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2022 Virginia Tech.
+#
+# This is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this software; see the file COPYING.  If not, write to
+# the Free Software Foundation, Inc., 51 Franklin Street,
+# Boston, MA 02110-1301, USA.
+#
+
+import numpy as np
+
+
+def _p2_step(q, n, d, incr, x):
+    """
+    One step of the P-square algorithm, in place
+
+    `q`, `n` and `d` hold the heights, actual and desired positions of the
+    five markers, either as lists of floats for a single estimator or as
+    sequences of five arrays for many estimators at once. Only arithmetic
+    works on both, so the branches are blended in instead of taken.
+    """
+    # Adjust the extremes
+    q[0] = q[0] + (x < q[0]) * (x - q[0])
+    q[4] = q[4] + (x > q[4]) * (x - q[4])
+
+    # Shift the positions of the markers above the observation
+    for i in range(1, 4):
+        n[i] = n[i] + (x < q[i])
+    n[4] = n[4] + 1
+    for i in range(5):
+        d[i] = d[i] + incr[i]
+
+    # Adjust the heights of the middle markers if they are off
+    for i in range(1, 4):
+        di = d[i] - n[i]
+        move = ((di >= 1) & (n[i + 1] - n[i] > 1)) | \
+            ((di <= -1) & (n[i - 1] - n[i] < -1))
+        up = di >= 0
+        sgn = 2 * up - 1
+
+        # Try the piecewise-parabolic prediction first
+        qp = q[i] + sgn / (n[i + 1] - n[i - 1]) * (
+            (n[i] - n[i - 1] + sgn) * (q[i + 1] - q[i]) / (n[i + 1] - n[i]) +
+            (n[i + 1] - n[i] - sgn) * (q[i] - q[i - 1]) / (n[i] - n[i - 1])
+        )
+
+        # Fall back to linear if it breaks the marker ordering
+        qj = q[i - 1] + up * (q[i + 1] - q[i - 1])
+        nj = n[i - 1] + up * (n[i + 1] - n[i - 1])
+        linear = q[i] + sgn * (qj - q[i]) / (nj - n[i])
+        ordered = (q[i - 1] < qp) & (qp < q[i + 1])
+        height = linear + ordered * (qp - linear)
+
+        q[i] = q[i] + move * (height - q[i])
+        n[i] = n[i] + move * sgn
+
+
+def _estimate(count, heights, quantile):
+    """
+    Quantile estimate from the marker heights, NaN where there is no data
+
+    Works on a single estimator or on arrays of them, with the five markers
+    along the last axis.
+    """
+    count = np.asarray(count)
+
+    # Use the exact quantile while there are fewer than five observations
+    index = np.minimum(count - 1, (quantile * count).astype(np.int64))
+    exact = np.take_along_axis(
+        heights, np.clip(index, 0, 4)[..., None], axis=-1
+    )[..., 0]
+
+    value = np.where(count < 5, exact, heights[..., 2])
+
+    return np.where(count == 0, np.nan, value)
+
+
+class p2_quantile(object):
+    """
+    Streaming quantile estimator using the P-square algorithm
+
+    Keeps five markers whose heights track the minimum, p/2, p, (1+p)/2 and
+    the maximum of the observations, so memory and update cost are O(1).
+    """
+    __slots__ = ('p', 'count', '_heights', '_pos', '_desired', '_incr')
+
+    def __init__(self, p=0.5):
+        # Check whether the quantile makes sense
+        if not 0.0 < p < 1.0:
+            raise ValueError('Invalid quantile: ' + str(p))
+
+        self.p = p
+        self.count = 0
+        # Marker heights, empty slots sort after the observations
+        self._heights = [float('inf')] * 5
+        # Actual and desired marker positions
+        self._pos = [1.0, 2.0, 3.0, 4.0, 5.0]
+        self._desired = [1.0, 1.0 + 2.0 * p, 1.0 + 4.0 * p, 3.0 + 2.0 * p, 5.0]
+        self._incr = [0.0, p / 2.0, p, (1.0 + p) / 2.0, 1.0]
+
+    def update(self, x):
+        self.count += 1
+
+        # Collect the first five observations, sorted
+        if self.count <= 5:
+            self._heights[self.count - 1] = x
+            self._heights.sort()
+            return
+
+        _p2_step(self._heights, self._pos, self._desired, self._incr, x)
+
+    def value(self):
+        return float(_estimate(self.count, np.array(self._heights), self.p))
+
+
+class beam_kpi_map(object):
+    """
+    Dense running statistics of the KPIs of every TX and RX beam pair
+
+    Every statistic is a (size, size) array indexed by the TX and RX beam
+    indices, so resets are a fill, the selection is an argmax over the whole
+    matrix and the arrays can be handed out for analysis without copies. The
+    median (or any other quantile) is tracked with the P-square algorithm,
+    which keeps five markers per pair and costs O(1) per KPI.
+    """
+    def __init__(self, size=64, quantile=0.5):
+        # Check whether the quantile makes sense
+        if not 0.0 < quantile < 1.0:
+            raise ValueError('Invalid quantile: ' + str(quantile))
+
+        self.size = size
+        self.quantile = quantile
+
+        self.count = np.zeros((size, size), dtype=np.int64)
+        self.mean = np.zeros((size, size))
+        # Sum of squared differences from the mean, as in Welford's method
+        self.m2 = np.zeros((size, size))
+        self.min = np.zeros((size, size))
+        self.max = np.zeros((size, size))
+
+        # P-square marker heights, actual and desired positions
+        self._heights = np.zeros((size, size, 5))
+        self._pos = np.zeros((size, size, 5))
+        self._desired = np.zeros((size, size, 5))
+        self._incr = np.array(
+            [0.0, quantile / 2.0, quantile, (1.0 + quantile) / 2.0, 1.0]
+        )
+
+        self.reset()
+
+    def reset(self):
+        """
+        Forget every measurement
+        """
+        self.count.fill(0)
+        self.mean.fill(0.0)
+        self.m2.fill(0.0)
+        self.min.fill(np.inf)
+        self.max.fill(-np.inf)
+
+        # Empty marker slots sort after the observations
+        self._heights.fill(np.inf)
+        self._pos[...] = np.arange(1.0, 6.0)
+        p = self.quantile
+        self._desired[...] = [1.0, 1.0 + 2.0 * p, 1.0 + 4.0 * p, 3.0 + 2.0 * p, 5.0]
+
+    @property
+    def valid(self):
+        """
+        Mask of the beam pairs with at least one measurement
+        """
+        return self.count > 0
+
+    @property
+    def variance(self):
+        return np.divide(
+            self.m2, self.count - 1,
+            out=np.zeros_like(self.m2), where=self.count > 1
+        )
+
+    def robust(self):
+        """
+        Quantile estimate of every beam pair, NaN where there is no data
+        """
+        return _estimate(self.count, self._heights, self.quantile)
+
+    def robust_at(self, tx_beam, rx_beam):
+        """
+        Quantile estimate of a single beam pair, NaN if there is no data
+        """
+        return float(_estimate(
+            self.count[tx_beam, rx_beam], self._heights[tx_beam, rx_beam],
+            self.quantile
+        ))
+
+    def best(self):
+        """
+        Beam pair with the highest quantile estimate and its value
+        """
+        if not self.count.any():
+            return None
+
+        value = self.robust()
+        tx_beam, rx_beam = np.unravel_index(np.nanargmax(value), value.shape)
+
+        return int(tx_beam), int(rx_beam), float(value[tx_beam, rx_beam])
+
+    def export(self):
+        """
+        Views of the KPI statistics, indexed by TX and RX beam
+        """
+        return {
+            'valid': self.valid,
+            'count': self.count,
+            'mean': self.mean,
+            'variance': self.variance,
+            'min': self.min,
+            'max': self.max,
+            'robust': self.robust()
+        }
+
+    def update(self, tx_beam, rx_beam, kpi):
+        """
+        Add one or more KPIs, given as scalars or equally sized arrays
+        """
+        tx_beam = np.atleast_1d(np.asarray(tx_beam, dtype=np.intp))
+        rx_beam = np.atleast_1d(np.asarray(rx_beam, dtype=np.intp))
+        kpi = np.atleast_1d(np.asarray(kpi, dtype=np.float64))
+
+        # Fast path for the single KPI case
+        if len(kpi) == 1:
+            self._update_unique(tx_beam, rx_beam, kpi)
+            return
+
+        # Rank the repeated occurrences of each pair, in arrival order
+        flat = tx_beam * self.size + rx_beam
+        order = np.argsort(flat, kind='stable')
+        starts = np.flatnonzero(np.r_[True, np.diff(flat[order]) != 0])
+        lengths = np.diff(np.r_[starts, len(flat)])
+
+        # Long runs of a few pairs, e.g. a batch of one dwell, are cheaper
+        # one pair at a time
+        if lengths.max() > len(starts):
+            for start, length in zip(starts, lengths):
+                run = order[start:start + length]
+                self._update_sequence(tx_beam[run[0]], rx_beam[run[0]], kpi[run])
+            return
+
+        rank = np.empty(len(flat), dtype=np.intp)
+        rank[order] = np.arange(len(flat)) - np.repeat(starts, lengths)
+
+        # Process the batch in rounds that touch each pair at most once
+        for r in range(lengths.max()):
+            sel = rank == r
+            self._update_unique(tx_beam[sel], rx_beam[sel], kpi[sel])
+
+    def _update_sequence(self, t, r, x):
+        # Merge the count, mean and variance of the run in one go
+        count_a, count_b = int(self.count[t, r]), len(x)
+        count = count_a + count_b
+        mean_b = float(x.mean())
+        delta = mean_b - self.mean[t, r]
+        self.mean[t, r] += delta * count_b / count
+        self.m2[t, r] += float(np.sum((x - mean_b) ** 2)) + \
+            delta ** 2 * count_a * count_b / count
+        self.count[t, r] = count
+        self.min[t, r] = min(self.min[t, r], float(x.min()))
+        self.max[t, r] = max(self.max[t, r], float(x.max()))
+
+        # Run the P-square steps one observation at a time
+        estimator = p2_quantile(self.quantile)
+        estimator.count = count_a
+        estimator._heights = self._heights[t, r].tolist()
+        estimator._pos = self._pos[t, r].tolist()
+        estimator._desired = self._desired[t, r].tolist()
+
+        for x_i in x.tolist():
+            estimator.update(x_i)
+
+        self._heights[t, r] = estimator._heights
+        self._pos[t, r] = estimator._pos
+        self._desired[t, r] = estimator._desired
+
+    def _update_unique(self, t, r, x):
+        # Update the running count, mean and variance
+        count = self.count[t, r] + 1
+        self.count[t, r] = count
+        delta = x - self.mean[t, r]
+        mean = self.mean[t, r] + delta / count
+        self.mean[t, r] = mean
+        self.m2[t, r] += delta * (x - mean)
+        self.min[t, r] = np.minimum(self.min[t, r], x)
+        self.max[t, r] = np.maximum(self.max[t, r], x)
+
+        q = self._heights[t, r]
+        n = self._pos[t, r]
+        d = self._desired[t, r]
+
+        # Collect the first five observations of each pair, sorted
+        init = count <= 5
+        if init.any():
+            q[init, count[init] - 1] = x[init]
+            q[init] = np.sort(q[init], axis=1)
+
+        # Run the P-square step for the pairs with five or more KPIs
+        run = ~init
+        if run.any():
+            qr, nr, dr = q[run], n[run], d[run]
+            # One column per marker, so the step sees one array per marker
+            _p2_step(qr.T, nr.T, dr.T, self._incr, x[run])
+            q[run], n[run], d[run] = qr, nr, dr
+
+        self._heights[t, r] = q
+        self._pos[t, r] = n
+        self._desired[t, r] = d
+
+
+class beam_history(object):
+    """
+    Exponentially decayed KPI of every TX and RX beam pair across IAs
+
+    Every sweep merges the quantile estimates of the pairs it measured,
+    weighing the older ones down by `decay`. Pairs whose weight falls below
+    `min_weight` are forgotten. The history can be saved to and loaded from
+    a .npz file, to warm start after a restart.
+    """
+    def __init__(self, size=64, decay=0.5, min_weight=1e-3):
+        # Check whether the decay makes sense
+        if not 0.0 <= decay <= 1.0:
+            raise ValueError('Invalid decay: ' + str(decay))
+
+        self.size = size
+        self.decay = decay
+        self.min_weight = min_weight
+
+        self.kpi = np.zeros((size, size))
+        self.weight = np.zeros((size, size))
+
+    @property
+    def valid(self):
+        """
+        Mask of the beam pairs we remember
+        """
+        return self.weight > 0.0
+
+    def merge(self, kpi_map):
+        """
+        Fold the measurements of a beam_kpi_map into the history
+        """
+        measured = kpi_map.valid
+        weight = self.decay * self.weight
+
+        # Weighted average of the old value and the new measurement
+        self.kpi[measured] = (
+            weight[measured] * self.kpi[measured] + kpi_map.robust()[measured]
+        ) / (weight[measured] + 1.0)
+        weight[measured] += 1.0
+
+        # Forget the pairs we have not seen for a long time
+        weight[weight < self.min_weight] = 0.0
+        self.weight = weight
+
+    def ranking(self):
+        """
+        TX and RX beams of the pairs we remember, best first
+        """
+        tx_beam, rx_beam = np.nonzero(self.valid)
+        order = np.argsort(-self.kpi[tx_beam, rx_beam], kind='stable')
+
+        return tx_beam[order], rx_beam[order]
+
+    def load(self, path):
+        with np.load(path) as data:
+            self.kpi[...] = data['kpi']
+            self.weight[...] = data['weight']
+
+    def save(self, path):
+        # Write through a file object so numpy keeps the path as given
+        with open(path, 'wb') as history_file:
+            np.savez(history_file, kpi=self.kpi, weight=self.weight)
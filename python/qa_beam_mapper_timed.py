@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2022 Virginia Tech.
+#
+# This is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this software; see the file COPYING.  If not, write to
+# the Free Software Foundation, Inc., 51 Franklin Street,
+# Boston, MA 02110-1301, USA.
+#
+
+import os
+import time
+import pmt
+from gnuradio import gr, gr_unittest
+from stamina.beam_mapper import beam_mapper
+from stamina.timebase import clock
+
+CONFIG = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', 'examples', 'gpio_config.json'
+)
+
+class command_sink(gr.basic_block):
+    """
+    Stand-in for the command port of a USRP block, keeps every command
+    """
+    def __init__(self):
+        gr.basic_block.__init__(self, name="Command Sink", in_sig=None, out_sig=None)
+        self.commands = []
+        self.message_port_register_in(pmt.intern('command'))
+        self.set_msg_handler(pmt.intern('command'), self.command_msg_handler)
+
+    def command_msg_handler(self, msg):
+        self.commands.append(pmt.to_python(msg))
+
+class qa_beam_mapper_timed(gr_unittest.TestCase):
+
+    def setUp(self):
+        self.tb = gr.top_block()
+
+    def tearDown(self):
+        self.tb = None
+
+    def sweep(self, mapper, beam_ids):
+        # Send the beam changes and collect the timed commands
+        sink = command_sink()
+        self.tb.msg_connect((mapper, 'gpio_cmd'), (sink, 'command'))
+
+        self.tb.start()
+        for beam_id in beam_ids:
+            mapper.beam_id_msg_handler(pmt.to_pmt(beam_id))
+        time.sleep(0.5)
+        self.tb.stop()
+        self.tb.wait()
+
+        return [
+            (cmd['gpio']['value'], cmd['time'][0] + cmd['time'][1])
+            for cmd in sink.commands if 'time' in cmd
+        ]
+
+    def test_001_t(self):
+        # BA write, strobe and release land on the USRP schedule
+        mapper = beam_mapper(
+            tx_mhu='MHU1', rx_mhu='Off', backoff=1e-3, pulse=2e-3,
+            config_path=CONFIG, timed=True
+        )
+        host_time = clock.now()
+        mapper.set_usrp_time(100.0, host_time)
+
+        cmds = self.sweep(mapper, [{'tx': 5, 'time': host_time + 1.0}])
+
+        self.assertEqual([value for value, _ in cmds], [5 << 5, 1 << 5, 0])
+        self.assertFloatTuplesAlmostEqual(
+            [usrp_time for _, usrp_time in cmds], (101.0, 101.001, 101.003), 6
+        )
+
+    def test_002_t(self):
+        # Back-to-back changes never overlap, the anchor may come as a message
+        mapper = beam_mapper(
+            tx_mhu='MHU1', rx_mhu='MHU2', backoff=1e-3, pulse=2e-3,
+            config_path=CONFIG, timed=True, coalesce=True
+        )
+        host_time = clock.now()
+        mapper.usrp_time_msg_handler(
+            pmt.to_pmt({'usrp_time': 50.0, 'time': host_time})
+        )
+
+        cmds = self.sweep(mapper, [{'tx': 5, 'rx': 7, 'time': host_time + 1.0}])
+
+        # The strobe of a change is released by the BA write of the next
+        self.assertEqual([value for value, _ in cmds], [5 << 5, 1 << 5, 7 << 5, 1 << 6])
+        self.assertFloatTuplesAlmostEqual(
+            [usrp_time for _, usrp_time in cmds], (51.0, 51.001, 51.003, 51.004), 6
+        )
+
+    def test_003_t(self):
+        # Coalesced commands need the USRP to time them
+        with self.assertRaises(ValueError):
+            beam_mapper(config_path=CONFIG, coalesce=True)
+
+    def test_004_t(self):
+        # Commands per beam change, with and without the USRP timing them
+        for timed, coalesce, number in ((False, False, 3), (True, False, 3),
+                                        (True, True, 2)):
+            mapper = beam_mapper(
+                tx_mhu='MHU1', rx_mhu='MHU2', backoff=1e-6, pulse=1e-6,
+                config_path=CONFIG, timed=timed, coalesce=coalesce
+            )
+            mapper.set_usrp_time(10.0)
+            sent = []
+            mapper.message_port_pub = lambda port, msg: sent.append(msg)
+
+            for tx_beam in (1, 2, 3):
+                mapper.beam_id_msg_handler(pmt.to_pmt({'tx': tx_beam, 'rx': 4}))
+
+            # The RX beam only changes once
+            self.assertEqual(len(sent), 4 * number)
+            self.assertEqual(mapper.get_issued_writes(), 4 * number)
+
+    def test_005_t(self):
+        # A better anchor keeps the schedule, but tells when it was too late
+        mapper = beam_mapper(
+            tx_mhu='MHU1', rx_mhu='Off', backoff=1e-3, pulse=2e-3,
+            config_path=CONFIG, timed=True
+        )
+        mapper.message_port_pub = lambda port, msg: None
+        host_time = clock.now()
+        mapper.set_usrp_time(100.0, host_time)
+
+        mapper.beam_id_msg_handler(pmt.to_pmt({'tx': 5, 'time': host_time + 1.0}))
+        self.assertAlmostEqual(mapper._next_cmd_time, 101.004, 6)
+
+        with self.assertLogs(mapper.logging, level='WARNING'):
+            mapper.set_usrp_time(102.0, host_time)
+        self.assertAlmostEqual(mapper._next_cmd_time, 101.004, 6)
+
+        # A USRP time reset forgets it
+        mapper.set_usrp_time(0.0)
+        self.assertEqual(mapper._next_cmd_time, 0.0)
+
+
+if __name__ == '__main__':
+    gr_unittest.run(qa_beam_mapper_timed)
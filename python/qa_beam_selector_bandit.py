@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2022 Virginia Tech.
+#
+# This is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this software; see the file COPYING.  If not, write to
+# the Free Software Foundation, Inc., 51 Franklin Street,
+# Boston, MA 02110-1301, USA.
+#
+
+import os
+import tempfile
+import numpy as np
+import pmt
+from gnuradio import gr_unittest
+from stamina.beam_selector import beam_selector
+
+BEAMS = [1, 2, 3]
+
+def kpi(tx_beam, rx_beam):
+    # A single pair stands out
+    return -55.0 if (tx_beam, rx_beam) == (2, 3) else -60.0
+
+class qa_beam_selector_bandit(gr_unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def selector(self, bandit):
+        selector = beam_selector(
+            os.path.join(self.dir.name, 'pair.log'),
+            os.path.join(self.dir.name, 'kpi.log'),
+            bandit=bandit
+        )
+        selector._rng = np.random.default_rng(1)
+        self.addCleanup(selector.stop)
+
+        selector.trigger_msg_handler(pmt.to_pmt(
+            {'trigger': True, 'bandit': {'tx': BEAMS, 'rx': BEAMS}}
+        ))
+        return selector
+
+    def probe(self, selector, number):
+        # Ask for pairs to probe and measure each of them once
+        for _ in range(number):
+            selector.probe_msg_handler(pmt.to_pmt({'probe': True}))
+            tx_beam, rx_beam = selector._probe_trace[-1]
+            selector.val_msg_handler(pmt.to_pmt(
+                {'val': kpi(tx_beam, rx_beam), 'tx': tx_beam, 'rx': rx_beam}
+            ))
+
+    def test_001_t(self):
+        # UCB tries every pair once, then keeps to the best one
+        selector = self.selector('ucb')
+        self.probe(selector, 30)
+
+        trace = selector._probe_trace
+        self.assertEqual(len(set(trace[:9])), 9)
+        self.assertEqual(trace[9:], [(2, 3)] * 21)
+
+    def test_002_t(self):
+        # Thompson sampling ends up on the best pair too
+        selector = self.selector('thompson')
+        self.probe(selector, 60)
+
+        self.assertEqual(selector._probe_trace[-10:], [(2, 3)] * 10)
+
+    def test_003_t(self):
+        # The decision counts the probes and the KPI they cost
+        selector = self.selector('ucb')
+        self.probe(selector, 30)
+        selector.trigger_msg_handler(pmt.to_pmt({'trigger': False}))
+
+        stats = selector.get_bandit_stats()
+        self.assertEqual(stats['probes'], 30)
+        self.assertEqual(stats['pairs'], 9)
+        self.assertEqual(stats['candidates'], 9)
+        # Eight pairs probed once, 5 dB below the best
+        self.assertAlmostEqual(stats['regret'], 40.0)
+
+    def test_004_t(self):
+        # Probes only make sense within a bandit IA
+        selector = beam_selector(
+            os.path.join(self.dir.name, 'pair.log'),
+            os.path.join(self.dir.name, 'kpi.log')
+        )
+        self.addCleanup(selector.stop)
+
+        with self.assertRaises(ValueError):
+            selector.probe_msg_handler(pmt.to_pmt({'probe': True}))
+
+
+if __name__ == '__main__':
+    gr_unittest.run(qa_beam_selector_bandit)
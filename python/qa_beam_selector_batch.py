@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2022 Virginia Tech.
+#
+# This is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this software; see the file COPYING.  If not, write to
+# the Free Software Foundation, Inc., 51 Franklin Street,
+# Boston, MA 02110-1301, USA.
+#
+
+
+import os
+import tempfile
+import numpy as np
+import pmt
+from gnuradio import gr_unittest
+from stamina.beam_selector import beam_selector
+
+def batch(kpi, tx, rx, end):
+    return pmt.to_pmt({
+        'val': np.array(kpi, dtype=np.float32),
+        'tx': np.array(tx, dtype=np.uint8),
+        'rx': np.array(rx, dtype=np.uint8),
+        'end': end
+    })
+
+class qa_beam_selector_batch(gr_unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.sent = []
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def selector(self, **kwargs):
+        # Keep the messages instead of sending them
+        selector = beam_selector(
+            os.path.join(self.dir.name, 'pair.log'),
+            os.path.join(self.dir.name, 'kpi.log'),
+            **kwargs
+        )
+        selector.message_port_pub = \
+            lambda port, msg: self.sent.append(pmt.to_python(msg))
+        self.addCleanup(selector.stop)
+
+        return selector
+
+    def decisions(self):
+        return [msg['set_beam'] for msg in self.sent if 'set_beam' in msg]
+
+    def test_001_t(self):
+        # The selector waits for the last batch even if not told to
+        selector = self.selector()
+
+        selector.trigger_msg_handler(pmt.to_pmt({'trigger': True}))
+        selector.val_msg_handler(batch([], [], [], False))
+        selector.trigger_msg_handler(pmt.to_pmt({'trigger': False}))
+        self.assertEqual(self.decisions(), [])
+
+        selector.val_msg_handler(batch([-60.0, -50.0], [1, 2], [3, 4], True))
+        self.assertEqual(self.decisions(), [{'tx': 2, 'rx': 4}])
+
+    def test_002_t(self):
+        # The last batch may also come before the end of the sweep
+        selector = self.selector(batched=True)
+
+        selector.trigger_msg_handler(pmt.to_pmt({'trigger': True}))
+        selector.val_msg_handler(batch([-50.0, -60.0], [1, 2], [3, 4], True))
+        selector.trigger_msg_handler(pmt.to_pmt({'trigger': False}))
+        self.assertEqual(self.decisions(), [{'tx': 1, 'rx': 3}])
+
+
+if __name__ == '__main__':
+    gr_unittest.run(qa_beam_selector_batch)
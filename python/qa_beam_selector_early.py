@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2022 Virginia Tech.
+#
+# This is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this software; see the file COPYING.  If not, write to
+# the Free Software Foundation, Inc., 51 Franklin Street,
+# Boston, MA 02110-1301, USA.
+#
+
+
+
+import os
+import tempfile
+import numpy as np
+import pmt
+from gnuradio import gr_unittest
+from stamina.beam_selector import beam_selector
+from stamina.beam_sweep import beam_sweep
+
+def kpi(val, tx, rx):
+    return pmt.to_pmt({'val': val, 'tx': tx, 'rx': rx})
+
+def batch(kpi, tx, rx, end):
+    return pmt.to_pmt({
+        'val': np.array(kpi, dtype=np.float32),
+        'tx': np.array(tx, dtype=np.uint8),
+        'rx': np.array(rx, dtype=np.uint8),
+        'end': end
+    })
+
+class qa_beam_selector_early(gr_unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.sent = []
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def selector(self, **kwargs):
+        # Keep the messages instead of sending them
+        selector = beam_selector(
+            os.path.join(self.dir.name, 'pair.log'),
+            os.path.join(self.dir.name, 'kpi.log'),
+            threshold=-70.0,
+            **kwargs
+        )
+        selector.message_port_pub = \
+            lambda port, msg: self.sent.append(pmt.to_python(msg))
+        self.addCleanup(selector.stop)
+
+        return selector
+
+    def stops(self):
+        return [msg['set_beam'] for msg in self.sent if msg.get('early_stop', False)]
+
+    def test_001_t(self):
+        # A pair stops the sweep once it has enough KPIs above the threshold
+        selector = self.selector(early_stop=2)
+        selector.trigger_msg_handler(pmt.to_pmt({'trigger': True}))
+
+        selector.val_msg_handler(kpi(-80.0, 1, 1))
+        selector.val_msg_handler(kpi(-80.0, 1, 1))
+        selector.val_msg_handler(kpi(-60.0, 2, 3))
+        self.assertEqual(self.stops(), [])
+
+        selector.val_msg_handler(kpi(-60.0, 2, 3))
+        self.assertEqual(self.stops(), [{'tx': 2, 'rx': 3}])
+
+        # Only once per sweep, which then needs no decision
+        selector.val_msg_handler(kpi(-50.0, 3, 3))
+        selector.val_msg_handler(kpi(-50.0, 3, 3))
+        selector.trigger_msg_handler(pmt.to_pmt({'trigger': False}))
+        self.assertEqual(
+            [msg['set_beam'] for msg in self.sent if 'set_beam' in msg],
+            [{'tx': 2, 'rx': 3}]
+        )
+
+        # The next sweep may stop early again
+        selector.trigger_msg_handler(pmt.to_pmt({'trigger': True}))
+        selector.val_msg_handler(kpi(-50.0, 3, 3))
+        selector.val_msg_handler(kpi(-50.0, 3, 3))
+        self.assertEqual(self.stops(), [{'tx': 2, 'rx': 3}, {'tx': 3, 'rx': 3}])
+
+    def test_002_t(self):
+        # Batches stop on their best pair with enough KPIs
+        selector = self.selector(early_stop=2)
+        selector.trigger_msg_handler(pmt.to_pmt({'trigger': True}))
+
+        selector.val_msg_handler(batch([-50.0, -60.0], [1, 2], [1, 2], False))
+        self.assertEqual(self.stops(), [])
+
+        selector.val_msg_handler(
+            batch([-50.0, -60.0, -65.0, -55.0], [1, 2, 3, 3], [1, 2, 3, 3], False)
+        )
+        self.assertEqual(self.stops(), [{'tx': 1, 'rx': 1}])
+
+        # Once, and the last batch needs no decision
+        selector.val_msg_handler(batch([-40.0, -40.0], [3, 3], [3, 3], True))
+        selector.trigger_msg_handler(pmt.to_pmt({'trigger': False}))
+        self.assertEqual(
+            [msg['set_beam'] for msg in self.sent if 'set_beam' in msg],
+            [{'tx': 1, 'rx': 1}]
+        )
+
+    def test_003_t(self):
+        # No pair above the threshold, no early stop
+        selector = self.selector(early_stop=1)
+        selector.trigger_msg_handler(pmt.to_pmt({'trigger': True}))
+
+        selector.val_msg_handler(kpi(-80.0, 1, 1))
+        selector.val_msg_handler(batch([-75.0, -90.0], [1, 2], [2, 2], False))
+        self.assertEqual(self.stops(), [])
+
+    def test_004_t(self):
+        # The early stop aborts the sweep, other decisions don't
+        sweep = beam_sweep(tx_iterable=[1, 2, 3], rx_iterable=[1, 2])
+
+        sweep.sweep_msg_handler(pmt.to_pmt({'set_beam': {'tx': 1, 'rx': 2}}))
+        self.assertFalse(sweep._abort.is_set())
+
+        sweep.sweep_msg_handler(pmt.to_pmt({
+            'set_beam': {'tx': 2, 'rx': 1}, 'kpi': -60.0, 'early_stop': True
+        }))
+        self.assertTrue(sweep._abort.is_set())
+        self.assertEqual(sweep.new_set_beam, {'tx': 2, 'rx': 1})
+
+
+if __name__ == '__main__':
+    gr_unittest.run(qa_beam_selector_early)
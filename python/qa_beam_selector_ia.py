@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2022 Virginia Tech.
+#
+# This is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this software; see the file COPYING.  If not, write to
+# the Free Software Foundation, Inc., 51 Franklin Street,
+# Boston, MA 02110-1301, USA.
+#
+
+
+import os
+import tempfile
+import pmt
+from gnuradio import gr_unittest
+from stamina.beam_selector import beam_selector
+from stamina.binary_log import read
+
+class qa_beam_selector_ia(gr_unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'pair.log')
+        self.selector = beam_selector(self.path, os.path.join(self.dir.name, 'kpi.log'))
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def stage(self, final, tx_beam, rx_beam, tracking=False):
+        # Sweep a single pair and close the stage
+        self.selector.trigger_msg_handler(pmt.to_pmt(
+            {'trigger': True, 'tracking': tracking}
+        ))
+        self.selector.val_msg_handler(pmt.to_pmt(
+            {'val': -60.0, 'tx': tx_beam, 'rx': rx_beam}
+        ))
+        self.selector.trigger_msg_handler(pmt.to_pmt(
+            {'trigger': False, 'final': final, 'tracking': tracking}
+        ))
+
+    def test_001_t(self):
+        # The decisions of every stage of an IA share its number
+        self.stage(False, 1, 2)
+        self.stage(True, 3, 4)
+        self.stage(False, 5, 6)
+        self.stage(False, 7, 8)
+        self.stage(True, 9, 10)
+        self.selector.stop()
+
+        records, _ = read(self.path)
+        self.assertEqual(records['ia'].tolist(), [1, 1, 2, 2, 2])
+        self.assertEqual(records['tx'].tolist(), [1, 3, 5, 7, 9])
+
+    def test_002_t(self):
+        # Tracking rounds keep the number of the IA they follow
+        self.stage(False, 1, 2)
+        self.stage(True, 3, 4)
+        self.stage(True, 3, 5, tracking=True)
+        self.stage(True, 3, 6, tracking=True)
+        self.stage(True, 7, 8)
+        self.selector.stop()
+
+        records, _ = read(self.path)
+        self.assertEqual(records['ia'].tolist(), [1, 1, 1, 1, 2])
+
+
+if __name__ == '__main__':
+    gr_unittest.run(qa_beam_selector_ia)
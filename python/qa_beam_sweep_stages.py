@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2022 Virginia Tech.
+#
+# This is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this software; see the file COPYING.  If not, write to
+# the Free Software Foundation, Inc., 51 Franklin Street,
+# Boston, MA 02110-1301, USA.
+#
+
+
+import pmt
+from gnuradio import gr_unittest
+from stamina.beam_sweep import beam_sweep
+
+class qa_beam_sweep_stages(gr_unittest.TestCase):
+
+    def setUp(self):
+        self.sweep = beam_sweep(tx_iterable=[1, 2, 3], rx_iterable=[1, 2])
+
+    def ia(self, mode, slots, kpi, aborted=False):
+        # Report an IA as if the sweep thread had just run it
+        self.sweep._ia_slots = slots
+        self.sweep.new_set_kpi = kpi
+        if aborted:
+            self.sweep._abort.set()
+        else:
+            self.sweep._abort.clear()
+        self.sweep.report(mode)
+
+        return self.sweep.get_ia_stats()
+
+    def test_001_t(self):
+        # Exhaustive sweeps cut short are no reference
+        self.assertIsNone(self.ia('exhaustive', 2, -74.0, aborted=True)['loss'])
+        self.assertIsNone(self.ia('hierarchical', 3, -65.0)['loss'])
+
+        # A complete one is
+        self.assertEqual(self.ia('exhaustive', 6, -60.0)['loss'], 0.0)
+        stats = self.ia('hierarchical', 3, -65.0)
+        self.assertEqual(stats['loss'], 5.0)
+        self.assertEqual(stats['speedup'], 2.0)
+
+        # And stays so after another early stop
+        self.assertEqual(self.ia('exhaustive', 1, -74.0, aborted=True)['loss'], 14.0)
+
+    def test_002_t(self):
+        # Both edges of a tracking round say it is one
+        sweep = beam_sweep(
+            tx_iterable=[1, 2, 3], rx_iterable=[1, 2], beam_period=1e-3,
+            decision_timeout=1e-2
+        )
+        sent = []
+        sweep.message_port_pub = \
+            lambda port, msg: sent.append((pmt.symbol_to_string(port), pmt.to_python(msg)))
+
+        sweep.track({'tx': 2, 'rx': 1})
+
+        triggers = [msg for port, msg in sent if port == 'trigger']
+        self.assertEqual(len(triggers), 2)
+        self.assertTrue(all(msg['tracking'] for msg in triggers))
+        self.assertFalse(triggers[1]['trigger'])
+        self.assertEqual(sweep.track_slots, 6)
+
+
+if __name__ == '__main__':
+    gr_unittest.run(qa_beam_sweep_stages)
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2022 Virginia Tech.
+#
+# This is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this software; see the file COPYING.  If not, write to
+# the Free Software Foundation, Inc., 51 Franklin Street,
+# Boston, MA 02110-1301, USA.
+#
+
+from gnuradio import gr, gr_unittest
+from gnuradio import blocks
+import pmt
+from time import monotonic
+from stamina.beam_tagger import beam_tagger
+
+class qa_beam_tagger(gr_unittest.TestCase):
+
+    def setUp(self):
+        self.tb = gr.top_block()
+
+    def tearDown(self):
+        self.tb = None
+
+    def test_001_t(self):
+        # Samples go through untouched, a past change lands on the first one
+        data = [1+1j, 2+2j, 3+3j, 4+4j]
+
+        src = blocks.vector_source_c(data)
+        tagger = beam_tagger(samp_rate=1e6)
+        dst = blocks.vector_sink_c()
+
+        tagger.beam_id_msg_handler(pmt.to_pmt({'tx': 3, 'rx': 5}))
+
+        self.tb.connect(src, tagger, dst)
+        self.tb.run()
+
+        self.assertComplexTuplesAlmostEqual(dst.data(), data, 5)
+
+        tags = dst.tags()
+        self.assertEqual(len(tags), 1)
+        self.assertEqual(tags[0].offset, 0)
+        self.assertEqual(pmt.symbol_to_string(tags[0].key), 'beam_id')
+
+        value = pmt.to_python(tags[0].value)
+        self.assertEqual((value['tx'], value['rx']), (3, 5))
+
+    def test_002_t(self):
+        # Changes scheduled after the last sample are not tagged yet
+        src = blocks.vector_source_c([0j] * 4)
+        tagger = beam_tagger(samp_rate=1e6)
+        dst = blocks.vector_sink_c()
+
+        tagger.beam_id_msg_handler(
+            pmt.to_pmt({'tx': 3, 'rx': 5, 'time': monotonic() + 60.0})
+        )
+
+        self.tb.connect(src, tagger, dst)
+        self.tb.run()
+
+        self.assertEqual(len(dst.tags()), 0)
+
+    def test_003_t(self):
+        # Beam changes need both beams
+        with self.assertRaises(ValueError):
+            beam_tagger().beam_id_msg_handler(pmt.to_pmt({'tx': 3}))
+
+    def test_004_t(self):
+        # The rx_time tags anchor the USRP time to the host clock
+        tag = gr.tag_t()
+        tag.offset = 0
+        tag.key = pmt.intern('rx_time')
+        tag.value = pmt.make_tuple(pmt.from_uint64(5), pmt.from_double(0.25))
+
+        src = blocks.vector_source_c([0j] * 4, False, 1, [tag])
+        tagger = beam_tagger(samp_rate=1e6)
+        dst = blocks.vector_sink_c()
+
+        before = monotonic()
+        self.tb.connect(src, tagger, dst)
+        self.tb.run()
+
+        usrp_time, host_time = tagger._usrp_clock.anchor
+        self.assertAlmostEqual(usrp_time, 5.25)
+        self.assertTrue(before - 1e-3 < host_time < monotonic())
+
+    def test_005_t(self):
+        # The edges of the sweep are tagged in order with the beam changes
+        src = blocks.vector_source_c([0j] * 4)
+        tagger = beam_tagger(samp_rate=1e6)
+        dst = blocks.vector_sink_c()
+
+        tagger.trigger_msg_handler(pmt.to_pmt({'trigger': True}))
+        tagger.beam_id_msg_handler(pmt.to_pmt({'tx': 3, 'rx': 5}))
+        tagger.trigger_msg_handler(pmt.to_pmt({'trigger': False, 'final': True}))
+
+        self.tb.connect(src, tagger, dst)
+        self.tb.run()
+
+        tags = dst.tags()
+        self.assertEqual(
+            [pmt.symbol_to_string(tag.key) for tag in tags],
+            ['trigger', 'beam_id', 'trigger']
+        )
+        self.assertFalse(pmt.to_python(tags[2].value)['trigger'])
+
+    def test_006_t(self):
+        # The anchor comes from the buffer that waited least in the queues
+        tagger = beam_tagger(samp_rate=1e3)
+        sent = []
+        tagger.message_port_pub = \
+            lambda port, msg: sent.append(pmt.to_python(msg))
+
+        tagger.reference(0, 5.0, 10.0)
+        for end, now in ((100, 10.2), (200, 10.25), (300, 10.5)):
+            tagger.anchor(end, now)
+
+        self.assertEqual(tagger._usrp_clock.anchor, (5.0, 10.05))
+        self.assertEqual([msg['time'] for msg in sent], [10.1, 10.05])
+
+        # Older periods are forgotten, so the anchor follows the drift
+        tagger.anchor(1000, 11.3)
+        self.assertEqual(tagger._usrp_clock.anchor, (5.0, 10.05))
+        tagger.anchor(2000, 12.4)
+        self.assertAlmostEqual(tagger._usrp_clock.anchor[1], 10.3)
+
+        # A new USRP time reference starts over
+        tagger.reference(2000, 7.0, 12.5)
+        tagger.anchor(2100, 12.6)
+        self.assertAlmostEqual(tagger._usrp_clock.anchor[0], 7.0)
+        self.assertAlmostEqual(tagger._usrp_clock.anchor[1], 12.5)
+
+
+if __name__ == '__main__':
+    gr_unittest.run(qa_beam_tagger)
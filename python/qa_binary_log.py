@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2022 Virginia Tech.
+#
+# This is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this software; see the file COPYING.  If not, write to
+# the Free Software Foundation, Inc., 51 Franklin Street,
+# Boston, MA 02110-1301, USA.
+#
+
+import csv
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+from gnuradio import gr_unittest
+from stamina.binary_log import binary_log, read, ring_log, ring_reader
+
+FIELDS = (('tx', 'u1'), ('rx', 'u1'), ('kpi', 'f4'))
+CONVERTER = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', 'apps', 'stamina_log_to_csv'
+)
+
+class qa_binary_log(gr_unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'kpi.log')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_001_t(self):
+        # Single records and batches come back in order
+        log = binary_log(self.path, FIELDS)
+        log.write(1, 2, -40.5)
+        log.write_batch([3, 4], [5, 6], [-41.0, -42.0])
+        log.write(7, 8, -43.0)
+        log.close()
+
+        records, header = read(self.path)
+
+        self.assertEqual(records['tx'].tolist(), [1, 3, 4, 7])
+        self.assertEqual(records['rx'].tolist(), [2, 5, 6, 8])
+        self.assertFloatTuplesAlmostEqual(
+            records['kpi'].tolist(), (-40.5, -41.0, -42.0, -43.0), 5
+        )
+        self.assertTrue((records['time_ns'] >= header['monotonic_ns']).all())
+
+    def test_002_t(self):
+        # Invalid records are dropped, the rest of the chunk is kept
+        log = binary_log(self.path, FIELDS)
+        log.write(1, 2, 'x')
+        log.write(3, 4, -40.0)
+        log.write(5)
+        log.close()
+
+        records, _ = read(self.path)
+        self.assertEqual(records['tx'].tolist(), [3])
+
+    def test_003_t(self):
+        # The writer keeps going after an invalid record
+        log = binary_log(self.path, FIELDS, chunk=1)
+        log.write(1, 2, 'x')
+        log.write(3, 4, -40.0)
+        log.close()
+
+        records, _ = read(self.path)
+        self.assertEqual(records['tx'].tolist(), [3])
+
+    def test_004_t(self):
+        # The converter adds the date of every record
+        log = binary_log(self.path, FIELDS)
+        log.write_batch([1, 2], [3, 4], [-40.0, -41.0])
+        log.close()
+
+        csv_path = os.path.join(self.dir.name, 'kpi.csv')
+        subprocess.run(
+            [sys.executable, CONVERTER, self.path, csv_path], check=True
+        )
+
+        with open(csv_path) as csv_file:
+            rows = list(csv.reader(csv_file))
+
+        self.assertEqual(rows[0], ['wall_time', 'time_ns', 'tx', 'rx', 'kpi'])
+        self.assertEqual([row[2:] for row in rows[1:]],
+                         [['1', '3', '-40.0'], ['2', '4', '-41.0']])
+        self.assertTrue(rows[1][0].endswith('Z'))
+
+    def test_005_t(self):
+        # The ring keeps the last records, oldest first
+        log = ring_log(self.path, FIELDS, 4)
+        reader = ring_reader(self.path)
+
+        for index in range(6):
+            log.write(index, index, -40.0 - index)
+
+        self.assertEqual(reader.count, 6)
+        self.assertEqual(reader.latest()['tx'].tolist(), [2, 3, 4, 5])
+        self.assertEqual(reader.latest(2)['tx'].tolist(), [4, 5])
+
+        # Only the end of a batch larger than the ring stays
+        log.write_batch(range(10, 16), range(6), [-50.0] * 6)
+        self.assertEqual(reader.count, 12)
+        self.assertEqual(reader.latest()['tx'].tolist(), [12, 13, 14, 15])
+
+        # Records that come after closing are dropped
+        log.close()
+        log.write(1, 2, -40.0)
+        log.write_batch([1], [2], [-40.0])
+        log.close()
+
+        records, header = read(self.path)
+        self.assertEqual(header['size'], 4)
+        self.assertEqual(records['tx'].tolist(), [12, 13, 14, 15])
+
+    def test_006_t(self):
+        # Records overwritten while they are copied are left out
+        log = ring_log(self.path, FIELDS, 4)
+        reader = ring_reader(self.path)
+        log.write_batch([0, 1, 2, 3], [0, 1, 2, 3], [-40.0] * 4)
+
+        class busy_ring(object):
+            # The writer overwrites two slots during the copy
+            def __getitem__(_, slots):
+                records = ring[slots]
+                log.write_batch([4, 5], [4, 5], [-41.0] * 2)
+                return records
+
+        ring = reader.records
+        reader.records = busy_ring()
+
+        self.assertEqual(reader.latest()['tx'].tolist(), [2, 3])
+        log.close()
+
+    def test_007_t(self):
+        # Every open log shares a single writer thread
+        def writers():
+            return [thread for thread in threading.enumerate()
+                    if thread.name == 'stamina-log-writer']
+
+        logs = [
+            binary_log(os.path.join(self.dir.name, f'{index}.log'), FIELDS)
+            for index in range(3)
+        ]
+        self.assertEqual(len(writers()), 1)
+
+        for index, log in enumerate(logs):
+            log.write(index, index, -40.0)
+            log.close()
+
+        # The thread stops with the last log, and starts again with the next
+        self.assertEqual(writers(), [])
+        log = binary_log(self.path, FIELDS)
+        log.write(9, 9, -40.0)
+        log.close()
+
+        for index in range(3):
+            records, _ = read(os.path.join(self.dir.name, f'{index}.log'))
+            self.assertEqual(records['tx'].tolist(), [index])
+        self.assertEqual(read(self.path)[0]['tx'].tolist(), [9])
+
+
+if __name__ == '__main__':
+    gr_unittest.run(qa_binary_log)
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2022 Virginia Tech.
+#
+# This is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this software; see the file COPYING.  If not, write to
+# the Free Software Foundation, Inc., 51 Franklin Street,
+# Boston, MA 02110-1301, USA.
+#
+
+
+import os
+import tempfile
+import numpy as np
+import pmt
+from gnuradio import gr_unittest
+from stamina.kpi_agg import kpi_agg
+from stamina.timebase import clock
+
+class stream_tag(object):
+    # Stand-in for the tags the scheduler hands to work()
+    def __init__(self, offset, key, value):
+        self.offset = offset
+        self.key = pmt.intern(key)
+        self.value = pmt.to_pmt(value)
+
+class qa_kpi_agg_logic(gr_unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.sent = []
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def agg(self, **kwargs):
+        # Keep the messages instead of sending them, the thread is not started
+        agg = kpi_agg(
+            os.path.join(self.dir.name, 'beam.log'),
+            os.path.join(self.dir.name, 'meas.log'),
+            **kwargs
+        )
+        agg.message_port_pub = \
+            lambda port, msg: self.sent.append(pmt.to_python(msg))
+
+        def close():
+            agg.meas_log.close()
+            agg.beam_log.close()
+        self.addCleanup(close)
+
+        return agg
+
+    def trigger(self, agg, trigger, **info):
+        agg.trigger_msg_handler(pmt.to_pmt(dict(info, trigger=trigger)))
+
+    def test_001_t(self):
+        # Every sweep opens with an empty batch and closes with the last one
+        agg = self.agg(batch='sweep')
+
+        self.trigger(agg, True)
+        self.assertEqual(len(self.sent), 1)
+        self.assertEqual(len(self.sent[0]['val']), 0)
+        self.assertFalse(self.sent[0]['end'])
+
+        agg.emit({'val': -60.0, 'tx': 1, 'rx': 2})
+        self.trigger(agg, False)
+        self.assertEqual(self.sent[-1]['tx'].tolist(), [1])
+        self.assertTrue(self.sent[-1]['end'])
+
+    def test_002_t(self):
+        # Tracking rounds keep the monitor reference and the calibration
+        agg = self.agg(monitor=True, calibrate=True, samp_rate=1e3)
+        agg._settle_times.append(1e-3)
+
+        self.trigger(agg, True)
+        self.trigger(agg, False)
+        self.assertEqual(self.sent, [{'min_dwell': 1e-3 + 300e-6}])
+
+        agg.monitor(-50.0)
+        self.trigger(agg, True, tracking=True)
+        self.trigger(agg, False, tracking=True)
+        self.assertEqual(len(self.sent), 1)
+        self.assertTrue(agg._data_mode)
+        self.assertEqual(agg._reference, -50.0)
+
+    def stream(self, agg, offset, samples, tags):
+        # Run work() on a buffer of samples with its tags
+        agg.nitems_read = lambda port: offset
+        agg.get_tags_in_window = lambda port, first, last, key: \
+            [tag for tag in tags if pmt.eq(tag.key, key)]
+        agg.work([np.asarray(samples, dtype=np.float32)], [])
+
+    def test_003_t(self):
+        # The last dwell keeps the samples that come after the trigger
+        agg = self.agg(use_tags=True, per_dwell=True)
+        self.trigger(agg, True)
+
+        self.stream(agg, 0, [-50.0] * 100,
+                    [stream_tag(0, 'beam_id', {'tx': 1, 'rx': 2})])
+        self.trigger(agg, False)
+        self.assertEqual(self.sent, [])
+
+        self.stream(agg, 100, [-50.0] * 40 + [-80.0] * 60,
+                    [stream_tag(140, 'trigger', {'trigger': False})])
+        self.assertEqual(len(self.sent), 1)
+        self.assertEqual(self.sent[0]['count'], 140)
+        self.assertAlmostEqual(self.sent[0]['val'], -50.0)
+        self.assertFalse(agg._trigger)
+
+    def test_004_t(self):
+        # The tag may come before the message
+        agg = self.agg(use_tags=True, per_dwell=True)
+        self.trigger(agg, True)
+
+        self.stream(agg, 0, [-50.0] * 100, [
+            stream_tag(0, 'beam_id', {'tx': 1, 'rx': 2}),
+            stream_tag(60, 'trigger', {'trigger': False})
+        ])
+        self.assertEqual(self.sent[0]['count'], 60)
+        self.trigger(agg, False)
+        self.assertFalse(agg._trigger)
+
+        # Tagged runs are only summarized per dwell
+        with self.assertRaises(ValueError):
+            self.agg(use_tags=True)
+
+    def test_005_t(self):
+        # Settling time of a step, and the traces we can't tell from
+        step = [(i * 1e-3, -80.0 if i < 3 else -50.0) for i in range(10)]
+        self.assertAlmostEqual(kpi_agg.settling_time(step, 1.0), 3e-3)
+
+        # Too short, already settled, and never settled
+        self.assertIsNone(kpi_agg.settling_time(step[:3], 1.0))
+        self.assertEqual(kpi_agg.settling_time(step[3:], 1.0), 0.0)
+        self.assertIsNone(
+            kpi_agg.settling_time(step[3:] + [(1e-2, -80.0)], 1.0)
+        )
+
+    def test_006_t(self):
+        # The trace is timed by the samples since the tag, not by the buffers
+        agg = self.agg(use_tags=True, per_dwell=True, calibrate=True, samp_rate=1e3)
+        self.trigger(agg, True)
+
+        self.stream(agg, 0, [-80.0] * 5 + [-50.0] * 5,
+                    [stream_tag(0, 'beam_id', {'tx': 1, 'rx': 2})])
+        self.stream(agg, 10, [-50.0] * 20,
+                    [stream_tag(20, 'beam_id', {'tx': 2, 'rx': 2})])
+
+        self.assertEqual(len(agg._settle_times), 1)
+        self.assertAlmostEqual(agg._settle_times[0], 5e-3)
+
+        # Without the sample rate there is no time to count in
+        with self.assertRaises(ValueError):
+            self.agg(calibrate=True)
+
+    def test_007_t(self):
+        # The merged moments of several buffers match those of the whole dwell
+        edges = np.linspace(-90.0, -30.0, 7)
+        agg = self.agg(per_dwell=True, hist_edges=edges)
+
+        rng = np.random.default_rng(7)
+        buffers = [rng.normal(-60.0 + 5 * i, 8.0, size) for i, size in
+                   enumerate((1, 17, 256, 3, 1000))]
+        samples = np.concatenate(buffers)
+
+        agg.open_dwell(1, 2)
+        for buffer in buffers:
+            agg.accumulate(buffer.astype(np.float32))
+        agg.flush()
+
+        samples = samples.astype(np.float32).astype(np.float64)
+        summary = self.sent[0]
+        self.assertEqual(summary['count'], len(samples))
+        self.assertAlmostEqual(summary['val'], samples.mean(), 9)
+        self.assertAlmostEqual(summary['std'], samples.std(), 9)
+        self.assertEqual(summary['min'], samples.min())
+        self.assertEqual(summary['max'], samples.max())
+        self.assertEqual(
+            summary['hist'].tolist(), np.histogram(samples, edges)[0].tolist()
+        )
+
+    def feed(self, agg, rss, dt):
+        # Monitor an RSS that comes dt after the previous one
+        if agg._level_time is not None:
+            agg._level_time = clock.now() - dt
+        agg.monitor(rss)
+
+    def reacquired(self):
+        return len([msg for msg in self.sent if msg.get('reacquire', False)])
+
+    def test_008_t(self):
+        # A drop beyond the margin asks for a single IA
+        agg = self.agg(monitor=True, drop_margin=6.0)
+
+        for rss in (-50.0, -50.0, -54.0):
+            self.feed(agg, rss, 1.0)
+        self.assertEqual(self.reacquired(), 0)
+
+        for rss in (-58.0, -60.0, -70.0):
+            self.feed(agg, rss, 1.0)
+        self.assertEqual(self.reacquired(), 1)
+
+        # Tracking rounds don't end the IA, only a final trigger-off does
+        self.trigger(agg, True, tracking=True)
+        self.trigger(agg, False, tracking=True)
+        self.feed(agg, -70.0, 1.0)
+        self.assertEqual(self.reacquired(), 1)
+
+        self.trigger(agg, True)
+        self.trigger(agg, False, final=False)
+        self.assertTrue(agg._ia_requested)
+        self.trigger(agg, True)
+        self.trigger(agg, False)
+
+        for rss in (-60.0, -60.0, -67.0):
+            self.feed(agg, rss, 1.0)
+        self.assertEqual(self.reacquired(), 2)
+        self.assertEqual(agg._reference, -60.0)
+
+    def test_009_t(self):
+        # A steady decline asks for an IA before the margin is crossed
+        agg = self.agg(monitor=True, drop_margin=100.0, trend=5.0)
+
+        # One dB per second is within the trend
+        for step in range(20):
+            self.feed(agg, -50.0 - 0.1 * step, 0.1)
+        self.assertEqual(self.reacquired(), 0)
+
+        # Ten dB per second is not
+        for step in range(20):
+            self.feed(agg, -52.0 - step, 0.1)
+        self.assertEqual(self.reacquired(), 1)
+        self.assertLess(agg._slope, -5.0)
+        self.assertLess(agg._reference - agg._level, 100.0)
+
+
+if __name__ == '__main__':
+    gr_unittest.run(qa_kpi_agg_logic)
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2022 Virginia Tech.
+#
+# This is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this software; see the file COPYING.  If not, write to
+# the Free Software Foundation, Inc., 51 Franklin Street,
+# Boston, MA 02110-1301, USA.
+#
+
+
+import numpy as np
+from gnuradio import gr_unittest
+from stamina.kpi_stats import beam_kpi_map, p2_quantile
+
+STATS = ('count', 'mean', 'm2', 'min', 'max', '_heights', '_pos', '_desired')
+
+class qa_kpi_stats(gr_unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(1)
+        self.tx = rng.integers(0, 4, 2000)
+        self.rx = rng.integers(0, 4, 2000)
+        self.kpi = rng.normal(-60.0, 3.0, 2000)
+
+    def assertSameStats(self, first, second):
+        for name in STATS:
+            np.testing.assert_allclose(
+                getattr(first, name), getattr(second, name), rtol=1e-9, err_msg=name
+            )
+
+    def test_001_t(self):
+        # One KPI at a time and whole batches in rounds end up the same
+        single = beam_kpi_map(4)
+        for tx_beam, rx_beam, kpi in zip(self.tx, self.rx, self.kpi):
+            single.update(tx_beam, rx_beam, kpi)
+
+        batched = beam_kpi_map(4)
+        for start in range(0, 2000, 100):
+            sel = slice(start, start + 100)
+            batched.update(self.tx[sel], self.rx[sel], self.kpi[sel])
+
+        self.assertSameStats(single, batched)
+
+    def test_002_t(self):
+        # Long runs of one pair, as in a dwell, match one KPI at a time
+        single = beam_kpi_map(4)
+        run = beam_kpi_map(4)
+        tx = np.repeat([1, 2], 1000)
+
+        for tx_beam, kpi in zip(tx, self.kpi):
+            single.update(tx_beam, 3, kpi)
+        # Runs that start below five KPIs and span both pairs
+        bounds = (0, 3, 700, 1000, 1500, 2000)
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            run.update(tx[start:end], np.full(end - start, 3), self.kpi[start:end])
+
+        self.assertSameStats(single, run)
+
+    def test_003_t(self):
+        # A reset fills every statistic back to empty
+        stats = beam_kpi_map(4)
+        stats.update(self.tx, self.rx, self.kpi)
+        stats.reset()
+
+        self.assertFalse(stats.valid.any())
+        self.assertTrue(np.isnan(stats.robust()).all())
+        self.assertTrue((stats.min == np.inf).all())
+        self.assertTrue((stats.max == -np.inf).all())
+        self.assertIsNone(stats.best())
+
+        # The map starts over as if it were new
+        fresh = beam_kpi_map(4)
+        stats.update(self.tx, self.rx, self.kpi)
+        fresh.update(self.tx, self.rx, self.kpi)
+        self.assertSameStats(stats, fresh)
+
+    def test_004_t(self):
+        # The best pair is the argmax of the quantile estimates
+        stats = beam_kpi_map(4)
+        stats.update([0, 1, 1, 3], [2, 1, 1, 0], [-70.0, -50.0, -52.0, -60.0])
+
+        self.assertEqual(stats.best(), (1, 1, -50.0))
+        self.assertTrue(np.isnan(stats.robust_at(2, 2)))
+
+        # Single pairs agree with the whole matrix, with few and many KPIs
+        stats.update(self.tx, self.rx, self.kpi)
+        robust = stats.robust()
+        for tx_beam in range(4):
+            for rx_beam in range(4):
+                self.assertEqual(stats.robust_at(tx_beam, rx_beam),
+                                 robust[tx_beam, rx_beam])
+
+    def test_005_t(self):
+        # The export hands out the statistics without copies
+        stats = beam_kpi_map(4)
+        stats.update(self.tx, self.rx, self.kpi)
+        export = stats.export()
+
+        self.assertEqual(
+            set(export),
+            {'valid', 'count', 'mean', 'variance', 'min', 'max', 'robust'}
+        )
+        self.assertIs(export['count'], stats.count)
+        self.assertIs(export['mean'], stats.mean)
+        self.assertEqual(export['count'].sum(), 2000)
+
+        pair = (self.tx == 1) & (self.rx == 2)
+        self.assertAlmostEqual(export['mean'][1, 2], self.kpi[pair].mean())
+        self.assertAlmostEqual(export['variance'][1, 2], self.kpi[pair].var(ddof=1))
+
+    def test_006_t(self):
+        # The P-square estimate stays close to the actual median
+        stats = beam_kpi_map(4)
+        stats.update(self.tx, self.rx, self.kpi)
+
+        for tx_beam in range(4):
+            for rx_beam in range(4):
+                pair = (self.tx == tx_beam) & (self.rx == rx_beam)
+                self.assertAlmostEqual(
+                    stats.robust_at(tx_beam, rx_beam), np.median(self.kpi[pair]),
+                    delta=0.5
+                )
+
+        # A single estimator tracks the same markers as the map
+        estimator = p2_quantile(0.5)
+        for kpi in self.kpi[:3]:
+            estimator.update(kpi)
+        self.assertEqual(estimator.value(), np.median(self.kpi[:3]))
+
+        for kpi in self.kpi[3:]:
+            estimator.update(kpi)
+        single = beam_kpi_map(1)
+        single.update(np.zeros(2000), np.zeros(2000), self.kpi)
+        self.assertAlmostEqual(estimator.value(), single.robust_at(0, 0))
+        self.assertAlmostEqual(estimator.value(), np.median(self.kpi), delta=0.2)
+
+
+if __name__ == '__main__':
+    gr_unittest.run(qa_kpi_stats)
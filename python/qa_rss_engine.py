@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2022 Virginia Tech.
+#
+# This is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this software; see the file COPYING.  If not, write to
+# the Free Software Foundation, Inc., 51 Franklin Street,
+# Boston, MA 02110-1301, USA.
+#
+
+from gnuradio import gr, gr_unittest
+from gnuradio import blocks
+import pmt
+from rss_engine import rss_engine
+
+class qa_rss_engine(gr_unittest.TestCase):
+
+    def setUp(self):
+        self.tb = gr.top_block()
+
+    def tearDown(self):
+        self.tb = None
+
+    def test_001_t(self):
+        # Two windows with power 1 and 100
+        data = [1+0j] * 10 + [0+10j] * 10
+
+        src = blocks.vector_source_c(data)
+        rss = rss_engine(decimation=10)
+        dst = blocks.vector_sink_f()
+
+        self.tb.connect(src, rss, dst)
+        self.tb.run()
+
+        self.assertFloatTuplesAlmostEqual(dst.data(), (0.0, 20.0), 5)
+
+    def test_002_t(self):
+        # Silence should be clamped to the floor instead of -inf
+        src = blocks.vector_source_c([0j] * 8)
+        rss = rss_engine(decimation=4, floor=-150.0)
+        dst = blocks.vector_sink_f()
+
+        self.tb.connect(src, rss, dst)
+        self.tb.run()
+
+        self.assertFloatTuplesAlmostEqual(dst.data(), (-150.0, -150.0), 5)
+
+    def test_003_t(self):
+        # Invalid decimation values
+        with self.assertRaises(ValueError):
+            rss_engine(decimation=0)
+
+    def test_004_t(self):
+        # A beam change closes the window early, so none mixes two beams
+        data = [1+0j] * 5 + [0+10j] * 7 + [2+0j] * 10
+
+        tag = gr.tag_t()
+        tag.offset = 5
+        tag.key = pmt.intern('beam_id')
+        tag.value = pmt.from_long(1)
+
+        src = blocks.vector_source_c(data, False, 1, [tag])
+        rss = rss_engine(decimation=10)
+        dst = blocks.vector_sink_f()
+
+        self.tb.connect(src, rss, dst)
+        self.tb.run()
+
+        self.assertFloatTuplesAlmostEqual(dst.data(), (0.0, 20.0, 6.0206), 4)
+
+        # The tag moves to the window the beam starts
+        self.assertEqual([t.offset for t in dst.tags()], [1])
+
+
+if __name__ == '__main__':
+    gr_unittest.run(qa_rss_engine)
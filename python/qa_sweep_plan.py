@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2022 Virginia Tech.
+#
+# This is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this software; see the file COPYING.  If not, write to
+# the Free Software Foundation, Inc., 51 Franklin Street,
+# Boston, MA 02110-1301, USA.
+#
+
+
+from gnuradio import gr_unittest
+from stamina import sweep_plan
+
+def sides_changed(slots):
+    # Number of sides that change from each slot to the next
+    return [
+        (a[0] != b[0]) + (a[1] != b[1]) for a, b in zip(slots[:-1], slots[1:])
+    ]
+
+class qa_sweep_plan(gr_unittest.TestCase):
+
+    def test_001_t(self):
+        # Gray ranks undo the Gray code
+        for index in range(64):
+            self.assertEqual(sweep_plan.gray_rank(index ^ (index >> 1)), index)
+
+    def test_002_t(self):
+        # Every other TX run is reversed
+        slots = sweep_plan.snake(sweep_plan.exhaustive(range(3), range(3)))
+
+        self.assertEqual(slots, [
+            (0, 0), (0, 1), (0, 2), (1, 2), (1, 1), (1, 0), (2, 0), (2, 1), (2, 2)
+        ])
+
+    def test_003_t(self):
+        # Snake and Gray orders keep the pairs and change one side per slot
+        slots = sweep_plan.exhaustive(range(8), range(8))
+
+        for order in ('snake', 'gray'):
+            swept = sweep_plan.ordered(slots, order)
+            self.assertEqual(sorted(swept), sorted(slots))
+            self.assertEqual(set(sides_changed(swept)), {1})
+
+        # Gray order flips a single bit of the beam index
+        swept = sweep_plan.ordered(slots, 'gray')
+        for a, b in zip(swept[:-1], swept[1:]):
+            self.assertEqual(bin((a[0] ^ b[0]) | (a[1] ^ b[1])).count('1'), 1)
+
+        self.assertEqual(sweep_plan.ordered(slots, 'nested'), slots)
+        with self.assertRaises(ValueError):
+            sweep_plan.ordered(slots, 'random')
+
+    def test_004_t(self):
+        # Neighbor order moves out one ring at a time, snaking within each
+        slots = sweep_plan.exhaustive(range(5), range(5))
+        swept = sweep_plan.ordered(slots, 'neighbor', (2, 2))
+
+        rings = [max(abs(tx - 2), abs(rx - 2)) for tx, rx in swept]
+        self.assertEqual(sorted(swept), sorted(slots))
+        self.assertEqual(swept[0], (2, 2))
+        self.assertEqual(rings, sorted(rings))
+        self.assertEqual(swept[1:9], [
+            (1, 1), (1, 2), (1, 3), (2, 3), (2, 1), (3, 1), (3, 2), (3, 3)
+        ])
+
+        # Within a ring, a single side changes from one slot to the next
+        changed = sides_changed(swept)
+        for index, count in enumerate(changed):
+            if rings[index] == rings[index + 1]:
+                self.assertEqual(count, 1)
+
+    def test_005_t(self):
+        # With a graph, hops follow the graph instead of the list
+        circle = {beam: [(beam - 1) % 6, (beam + 1) % 6] for beam in range(6)}
+        slots = sweep_plan.exhaustive(range(6), [0])
+        swept = sweep_plan.ordered(slots, 'neighbor', (0, 0), circle)
+
+        self.assertEqual([tx for tx, _ in swept[:3]], [0, 1, 5])
+        self.assertEqual(swept[-1], (3, 0))
+        self.assertEqual(sweep_plan.neighbors(range(6), 0, 1, circle), [0, 5, 1])
+        self.assertEqual(sweep_plan.neighbors(range(6), 0, 1), [0, 1])
+
+    def test_006_t(self):
+        # Hierarchical stages cover fewer pairs than a full sweep
+        beams = range(16)
+
+        first = sweep_plan.hierarchical_stage(beams, beams, 4)
+        self.assertEqual(len(first), 16)
+        self.assertEqual(sorted({tx for tx, _ in first}), [0, 4, 8, 12])
+
+        # Finer stages stay within the radius of the best pair
+        second = sweep_plan.hierarchical_stage(beams, beams, 2, (8, 4), 4)
+        self.assertEqual(len(second), 9)
+        self.assertEqual(sorted({tx for tx, _ in second}), [6, 8, 10])
+        self.assertEqual(sorted({rx for _, rx in second}), [2, 4, 6])
+
+        last = sweep_plan.hierarchical_stage(beams, beams, 1, (8, 4), 2)
+        self.assertEqual(len(last), 9)
+
+        # Near the edges, the neighborhood is cut short
+        edge = sweep_plan.hierarchical_stage(beams, beams, 1, (0, 15), 4)
+        self.assertEqual(len(edge), 16)
+
+
+if __name__ == '__main__':
+    gr_unittest.run(qa_sweep_plan)
@@ -25,14 +25,15 @@ import numpy as np
 from gnuradio import gr
 from time import sleep
 from threading import Thread, Lock, Event
-from datetime import datetime
+
+from .binary_log import open_log
 
 class rate_measure(gr.sync_block):
     """
     docstring for block rate_measure
     """
     def __init__(self, meas_file="/home/joao/rate_meas.log", meas_period=1e-3,
-                 debug=False):
+                 debug=False, ring_size=0):
 
         gr.sync_block.__init__(self,
             name="Rate Measure",
@@ -58,9 +59,10 @@ class rate_measure(gr.sync_block):
         self._finished = Event()
         self._lock = Lock()
 
-        # Create files to save log information
-        self.meas_log = open(meas_file, "w")
-        self.meas_log.write("measurement,throughput,overhead\n")
+        # Create files to save log information, a bounded ring if sized
+        self.meas_log = open_log(
+            meas_file, (('throughput', 'f8'), ('overhead', 'f8')), ring_size
+        )
 
     def start(self):
         """
@@ -92,8 +94,8 @@ class rate_measure(gr.sync_block):
             # Raise error
             raise ValueError('Missing trigger references: ' + str(p_msg))
 
-        # Set the new value
-        self.trigger = p_msg.get('trigger', True)
+        # Set the new value, the IA goes on between the stages of a search
+        self.trigger = p_msg.get('trigger', True) or not p_msg.get('final', True)
 
     def measure(self):
         """
@@ -126,9 +128,7 @@ class rate_measure(gr.sync_block):
                 self._num_samples = 0
 
             # Dump the rate onto a file
-            self.meas_log.write(
-                f"{datetime.now().strftime('%H:%M:%S.%f')},{thx_rate},{ovd_rate}\n"
-            )
+            self.meas_log.write(thx_rate, ovd_rate)
 
         # Close files we left open
         self.meas_log.close()
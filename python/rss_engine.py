@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2022 Virginia Tech.
+#
+# This is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this software; see the file COPYING.  If not, write to
+# the Free Software Foundation, Inc., 51 Franklin Street,
+# Boston, MA 02110-1301, USA.
+#
+
+import numpy as np
+import pmt
+from gnuradio import gr
+
+
+class rss_engine(gr.basic_block):
+    """
+    Fused RSS estimator that emits one value per window of samples
+
+    Computes the mean power of every window of `decimation` samples in the
+    linear domain and only takes the logarithm of the output. Every beam_id
+    tag starts a new window, closing the previous one early, so no window
+    mixes two beams. With the decimation at beam_period * samp_rate or more,
+    that is one value per dwell. Tags go out on the window they fall in.
+    """
+    def __init__(self, decimation=1000, floor=-200.0):
+
+        # Check whether the decimation makes sense
+        if not isinstance(decimation, int) or decimation < 1:
+            raise ValueError('Invalid decimation: ' + str(decimation))
+
+        gr.basic_block.__init__(self,
+            name="RSS Engine",
+            in_sig=[np.complex64],
+            out_sig=[np.float32]
+        )
+
+        # We move the tags ourselves, as the rate changes at every beam_id
+        self.set_tag_propagation_policy(gr.TPP_DONT)
+
+        # Set class variables
+        self._decimation = decimation
+        self._tag_key = pmt.intern('beam_id')
+        # Lowest power we report, keeps log10 away from zero
+        self._floor = floor
+        self._floor_lin = 10.0 ** (floor / 10.0)
+
+    def get_decimation(self):
+        return self._decimation
+
+    def get_floor(self):
+        return self._floor
+
+    def set_floor(self, floor):
+        self._floor = floor
+        self._floor_lin = 10.0 ** (floor / 10.0)
+
+    def forecast(self, noutput_items, ninput_items_required):
+        # A full window per output, fewer if a beam_id tag closes one early
+        for i in range(len(ninput_items_required)):
+            ninput_items_required[i] = noutput_items * self._decimation
+
+    def windows(self, length, changes):
+        """
+        Start and end of the windows of a buffer, given where the beams change
+
+        The samples after the last full window wait for the next buffer,
+        unless a beam change closes them.
+        """
+        bounds = []
+        first = 0
+        for last in list(changes) + [length]:
+            starts = np.arange(first, last, self._decimation)
+
+            # A window cut short by a beam change is closed anyway
+            if last < length:
+                bounds.append(np.stack((starts, np.minimum(starts + self._decimation, last)), 1))
+            else:
+                starts = starts[starts + self._decimation <= length]
+                bounds.append(np.stack((starts, starts + self._decimation), 1))
+
+            first = last
+
+        return np.concatenate(bounds)
+
+    def general_work(self, input_items, output_items):
+        samples = input_items[0]
+        out = output_items[0]
+        start = self.nitems_read(0)
+
+        # Every beam change starts a new window
+        changes = sorted({
+            tag.offset - start
+            for tag in self.get_tags_in_window(0, 0, len(samples), self._tag_key)
+            if tag.offset > start
+        })
+
+        bounds = self.windows(len(samples), changes)[:len(out)]
+        num_out = len(bounds)
+        if not num_out:
+            return 0
+
+        consumed = int(bounds[-1, 1])
+
+        # Power is I^2 + Q^2, summed over the windows as interleaved I/Q floats
+        iq = samples[:consumed].view(np.float32).astype(np.float64)
+        energy = np.add.reduceat(iq * iq, 2 * bounds[:, 0])
+        power = energy / (bounds[:, 1] - bounds[:, 0])
+
+        # Only take the log of the output
+        np.log10(np.maximum(power, self._floor_lin), out=power)
+        out[:num_out] = 10.0 * power
+
+        # Move the tags to the window they fall in
+        written = self.nitems_written(0)
+        for tag in self.get_tags_in_window(0, 0, consumed):
+            index = np.searchsorted(bounds[:, 0], tag.offset - start, side='right') - 1
+            self.add_item_tag(0, written + int(index), tag.key, tag.value, tag.srcid)
+
+        self.consume(0, consumed)
+        return num_out
@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2022 Virginia Tech.
+#
+# This is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this software; see the file COPYING.  If not, write to
+# the Free Software Foundation, Inc., 51 Franklin Street,
+# Boston, MA 02110-1301, USA.
+#
+
+"""
+Beam pair sequences used by the beam_sweep block
+"""
+
+# Orders in which the pairs of a stage can be swept
+orders = ('nested', 'snake', 'gray', 'neighbor')
+
+
+def exhaustive(tx_iterable, rx_iterable):
+    """
+    Every TX and RX beam pair, with the TX beams in the outer loop
+    """
+    return [
+        (tx_index, rx_index)
+        for tx_index in tx_iterable
+        for rx_index in rx_iterable
+    ]
+
+
+def _around(beams, stride, center=None, radius=None):
+    """
+    Beams every `stride` positions, within `radius` positions of a center
+    """
+    beams = list(beams)
+
+    # Without a center, cover the whole list
+    if center is None or center not in beams:
+        return beams[::stride]
+
+    middle = beams.index(center)
+    return [
+        beam for position, beam in enumerate(beams)
+        if abs(position - middle) < radius and (position - middle) % stride == 0
+    ]
+
+
+def hierarchical_stage(tx_iterable, rx_iterable, stride, center=None, radius=None):
+    """
+    Beam pairs of one stage of a coarse-to-fine search
+
+    The first stage (no center) takes every `stride`-th beam of each list.
+    The following stages take every `stride`-th beam closer than `radius`
+    positions to the best (TX, RX) pair of the previous stage, which should
+    be the stride of the previous stage.
+    """
+    tx_center, rx_center = center if center is not None else (None, None)
+
+    return exhaustive(
+        _around(tx_iterable, stride, tx_center, radius),
+        _around(rx_iterable, stride, rx_center, radius)
+    )
+
+
+def ranked(slots, rank):
+    """
+    The same beam pairs, with the ones in `rank` first and in that order
+
+    The pairs missing from the ranking keep their order, after the others.
+    """
+    position = {pair: index for index, pair in enumerate(rank)}
+
+    return sorted(slots, key=lambda pair: position.get(pair, len(position)))
+
+
+def tx_stage(tx_iterable, rx_index):
+    """
+    Every TX beam, with the RX fixed on a single beam
+    """
+    return [(tx_index, rx_index) for tx_index in tx_iterable]
+
+
+def rx_stage(tx_index, rx_iterable):
+    """
+    Every RX beam, with the TX fixed on a single beam
+    """
+    return [(tx_index, rx_index) for rx_index in rx_iterable]
+
+
+def _hops(beams, center, graph=None):
+    """
+    Hops from a center beam to every beam it reaches, nearest first
+    """
+    beams = list(beams)
+
+    if graph is None:
+        if center not in beams:
+            return {center: 0}
+
+        middle = beams.index(center)
+        return {beam: abs(position - middle) for position, beam in enumerate(beams)}
+
+    # Breadth-first search of the beam-neighbor graph
+    hops = {center: 0}
+    frontier = [center]
+    while frontier:
+        next_frontier = []
+        for beam in frontier:
+            for neighbor in graph.get(beam, ()):
+                if neighbor in beams and neighbor not in hops:
+                    hops[neighbor] = hops[beam] + 1
+                    next_frontier.append(neighbor)
+        frontier = next_frontier
+
+    return hops
+
+
+def neighbors(beams, center, radius, graph=None):
+    """
+    Beams at most `radius` hops away from a center beam, center included
+
+    Without a graph, the neighbors of a beam are the adjacent beams of the
+    list. Otherwise, `graph` maps each beam index to its neighbor indices.
+    """
+    return [
+        beam for beam, hops in _hops(beams, center, graph).items()
+        if hops <= radius
+    ]
+
+
+def tracking_stage(tx_iterable, rx_iterable, center, radius, graph=None):
+    """
+    Beam pairs in the neighborhood of the current (TX, RX) pair
+    """
+    return exhaustive(
+        neighbors(tx_iterable, center[0], radius, graph),
+        neighbors(rx_iterable, center[1], radius, graph)
+    )
+
+
+def gray_rank(beam):
+    """
+    Position of a beam index in the Gray code sequence
+    """
+    rank = beam
+    shift = beam >> 1
+    while shift:
+        rank ^= shift
+        shift >>= 1
+
+    return rank
+
+
+def snake(slots):
+    """
+    Reverse every other run of pairs sharing the TX beam
+
+    Consecutive runs then meet on the same RX beam, so only one side
+    changes from one slot to the next.
+    """
+    runs = []
+    for tx_index, rx_index in slots:
+        if not runs or runs[-1][0][0] != tx_index:
+            runs.append([])
+        runs[-1].append((tx_index, rx_index))
+
+    return [
+        pair
+        for position, run in enumerate(runs)
+        for pair in (run if position % 2 == 0 else reversed(run))
+    ]
+
+
+def ordered(slots, order='nested', center=None, graph=None):
+    """
+    The same beam pairs, in the order given by `order`
+
+    'nested' keeps the order of the sequence, 'snake' only changes one side
+    per slot, 'gray' also sweeps each side in Gray code order so the beam
+    index pins flip one bit at a time, and 'neighbor' starts at the center
+    pair and moves outwards one ring at a time, snaking within each ring.
+    The ring of a pair is its larger number of hops from the center on
+    either side, counted as in neighbors().
+    """
+    if order == 'nested':
+        return list(slots)
+
+    if order == 'snake':
+        return snake(slots)
+
+    if order == 'gray':
+        return snake(sorted(
+            slots, key=lambda pair: (gray_rank(pair[0]), gray_rank(pair[1]))
+        ))
+
+    if order == 'neighbor':
+        if center is None:
+            return snake(slots)
+
+        tx_hops = _hops(dict.fromkeys(pair[0] for pair in slots), center[0], graph)
+        rx_hops = _hops(dict.fromkeys(pair[1] for pair in slots), center[1], graph)
+
+        # Beams the graph does not reach go in the last ring
+        unreachable = len(slots)
+        rings = {}
+        for pair in slots:
+            ring = max(tx_hops.get(pair[0], unreachable),
+                       rx_hops.get(pair[1], unreachable))
+            rings.setdefault(ring, []).append(pair)
+
+        return [pair for ring in sorted(rings) for pair in snake(rings[ring])]
+
+    raise ValueError('Invalid sweep order: ' + str(order))
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2022 Virginia Tech.
+#
+# This is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this software; see the file COPYING.  If not, write to
+# the Free Software Foundation, Inc., 51 Franklin Street,
+# Boston, MA 02110-1301, USA.
+#
+
+"""
+Time base shared by the STAMINA blocks
+
+Blocks timestamp events with the host monotonic clock, which never jumps.
+The clock is paired once with the wall clock, so any monotonic instant can
+be converted to wall time. Every USRP has its own clock, so each block that
+talks to one keeps its own usrp_clock anchor instead.
+"""
+
+from time import gmtime, monotonic, monotonic_ns, strftime, time_ns
+
+
+class timebase(object):
+    """
+    Host monotonic clock anchored to the wall clock
+    """
+    def __init__(self, monotonic_anchor=None, wall_anchor=None):
+        # Pair of monotonic and wall clocks in ns, read at the same instant
+        if monotonic_anchor is None:
+            monotonic_anchor, wall_anchor = monotonic_ns(), time_ns()
+        self.monotonic_anchor = monotonic_anchor
+        self.wall_anchor = wall_anchor
+        # Last formatted second, formatting is only redone when it changes
+        self._second = None
+        self._prefix = ''
+
+    # Host monotonic clock, in seconds and ns
+    now = staticmethod(monotonic)
+    now_ns = staticmethod(monotonic_ns)
+
+    def anchor(self):
+        """
+        The wall clock anchor, as stored in log headers
+        """
+        return {'monotonic_ns': self.monotonic_anchor, 'time_ns': self.wall_anchor}
+
+    def wall_ns(self, host_ns):
+        """
+        Convert an instant of the host monotonic clock, in ns, to wall time
+        """
+        return host_ns - self.monotonic_anchor + self.wall_anchor
+
+    def format(self, host_ns):
+        """
+        UTC date and time of an instant of the host monotonic clock, in ns
+        """
+        second, fraction = divmod(self.wall_ns(host_ns), 10 ** 9)
+
+        if second != self._second:
+            self._second = second
+            self._prefix = strftime('%Y-%m-%dT%H:%M:%S', gmtime(second))
+
+        return f'{self._prefix}.{fraction:09d}Z'
+
+
+class usrp_clock(object):
+    """
+    Clock of a single USRP, anchored to the host monotonic clock
+    """
+    def __init__(self):
+        # Pair of USRP time and host monotonic time taken at the same instant
+        self.anchor = None
+
+    @property
+    def anchored(self):
+        return self.anchor is not None
+
+    def set(self, usrp_time, host_time=None):
+        """
+        Anchor the USRP time, in seconds, to the host monotonic clock
+        """
+        self.anchor = (usrp_time, monotonic() if host_time is None else host_time)
+
+    def usrp_time(self, host_time):
+        """
+        Convert an instant of the host monotonic clock to USRP time
+        """
+        return self.anchor[0] + host_time - self.anchor[1]
+
+
+# Anchored once, when the module is first imported
+clock = timebase()